@@ -0,0 +1,147 @@
+"""Admission control for expensive routes.
+
+Expensive routes are grouped behind gates. A gate admits requests while their
+summed cost fits its capacity, queues a bounded number of the rest in FIFO
+order, and sheds load beyond that:
+
+- 429 when the gate's queue is full, rejected at once
+- 503 when a queued request waited longer than the gate's max_wait
+
+Both carry Retry-After, estimated from how long admitted requests have recently
+held the gate. Waiting happens on the event loop, before a request is handed to
+the threadpool, so queued requests for a busy gate never take threads away from
+cheap routes that are not gated.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+from fastapi import HTTPException, Request
+from metrics import LatencyRecorder, to_ms
+
+# Upper bound for every list endpoint's limit parameter
+MAX_PAGE_SIZE = 1000
+# A page costs one unit per this many requested rows
+ROWS_PER_UNIT = 100
+
+
+class Gate:
+    def __init__(self, name: str, capacity: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_use = 0
+        self._waiters = deque()  # (cost, future), oldest first
+        self._hold_seconds = 0.1  # moving average of how long a unit of cost is held
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.waits = LatencyRecorder()
+
+    def retry_after(self) -> int:
+        """Seconds until the work already admitted and queued should have drained."""
+        queued = sum(cost for cost, _ in self._waiters)
+        seconds = self._hold_seconds * (self.in_use + queued) / self.capacity
+        return min(60, max(1, math.ceil(seconds)))
+
+    def _reject(self, status_code: int, detail: str):
+        raise HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(self.retry_after())})
+
+    async def acquire(self, cost: int) -> int:
+        """Wait until cost fits in the gate; returns the cost actually taken (capped at capacity)."""
+        cost = max(1, min(cost, self.capacity))
+        started = time.monotonic()
+        if not self._waiters and self.in_use + cost <= self.capacity:
+            self.in_use += cost
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self.rejected_queue_full += 1
+                self._reject(429, f"Too many queued requests for {self.name}")
+            future = asyncio.get_running_loop().create_future()
+            entry = (cost, future)
+            self._waiters.append(entry)
+            try:
+                await asyncio.wait_for(future, self.max_wait)
+            except asyncio.TimeoutError:
+                # Unless the slot was granted just as the wait ran out
+                if future.cancelled():
+                    if entry in self._waiters:
+                        self._waiters.remove(entry)
+                    self.rejected_timeout += 1
+                    self._reject(503, f"Timed out waiting for {self.name}")
+            except BaseException:
+                # Cancelled (e.g. the client went away): give back a slot granted meanwhile
+                if future.done() and not future.cancelled():
+                    self.release(cost, 0.0)
+                elif entry in self._waiters:
+                    self._waiters.remove(entry)
+                raise
+        self.admitted += 1
+        self.waits.record(time.monotonic() - started)
+        return cost
+
+    def release(self, cost: int, held: float):
+        if held:
+            self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held / cost
+        self.in_use -= cost
+        # Wake waiters in order while the oldest fits, so large requests are not starved
+        while self._waiters and self.in_use + self._waiters[0][0] <= self.capacity:
+            cost, future = self._waiters.popleft()
+            if not future.done():
+                self.in_use += cost
+                future.set_result(None)
+
+    def metrics(self):
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "queue_wait_p50_ms": to_ms(self.waits.percentile(50)),
+            "queue_wait_p99_ms": to_ms(self.waits.percentile(99)),
+        }
+
+
+def create_gates() -> Dict[str, Gate]:
+    """A fresh set of gates; each app instance gets its own (app.state.gates)."""
+    return {
+        # Paged lists and filters, costed by page size
+        "lists": Gate("lists", capacity=10, max_queue=50, max_wait=2.0),
+        # Recipe lists load every recipe's lines and bundle; kept apart so a flood
+        # of full recipe pages cannot starve the cheap lists above
+        "recipe_lists": Gate("recipe_lists", capacity=10, max_queue=50, max_wait=2.0),
+        # Aggregates over the whole catalog
+        "reports": Gate("reports", capacity=4, max_queue=20, max_wait=5.0),
+        # Database backups and downloads
+        "exports": Gate("exports", capacity=1, max_queue=2, max_wait=10.0),
+    }
+
+
+def page_cost(request: Request) -> int:
+    try:
+        limit = int(request.query_params.get("limit", ROWS_PER_UNIT))
+    except ValueError:
+        return 1
+    return math.ceil(max(1, limit) / ROWS_PER_UNIT)
+
+
+def admit(gate_name: str, cost: Optional[Callable[[Request], int]] = None):
+    """Route dependency holding a slot of the app's named gate for the duration of the request."""
+    async def dependency(request: Request):
+        gate = request.app.state.gates[gate_name]
+        taken = await gate.acquire(cost(request) if cost else 1)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            gate.release(taken, time.monotonic() - started)
+
+    return dependency
+
+
+def metrics(gates: Dict[str, Gate]):
+    return {name: gate.metrics() for name, gate in gates.items()}
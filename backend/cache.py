@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+MAX_ENTRIES = 256
+# Bookkeeping tables nothing cached is derived from; bumping them would only add write contention
+UNVERSIONED_TABLES = {"idempotency_keys"}
+
+_BUMP_VERSION = (
+    "INSERT INTO table_versions (table_name, version) VALUES (?, 1) "
+    "ON CONFLICT (table_name) DO UPDATE SET version = version + 1"
+)
+
+
+def table_versions(db: Session) -> Dict[str, int]:
+    """Committed version of every table, as seen by this session's transaction."""
+    return dict(db.connection().exec_driver_sql("SELECT table_name, version FROM table_versions").all())
+
+
+class TableCache:
+    """Cache of derived values, invalidated when any table they were computed from changes.
+
+    Versions live in the shared table_versions table and are bumped inside every
+    writing transaction, so each uvicorn worker notices writes made by the others.
+    An entry is only served while the versions it was computed under are still
+    current; since the versions are read in the same transaction as the value is
+    computed, a cached value never lags behind its versions.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, db: Session, key: Hashable, tables: Iterable[str], compute: Callable[[], Any]) -> Any:
+        versions = table_versions(db)
+        generations = tuple(versions.get(table, 0) for table in sorted(tables))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generations:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = compute()
+
+        with self._lock:
+            self._entries[key] = (generations, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def metrics(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+cache = TableCache()
+
+
+@event.listens_for(Engine, "after_execute")
+def _track_writes(conn, clauseelement, multiparams, params, execution_options, result):
+    # Catches ORM flushes and Core INSERT/UPDATE/DELETE alike
+    if isinstance(clauseelement, UpdateBase) and clauseelement.table.name not in UNVERSIONED_TABLES:
+        conn.info.setdefault("changed_tables", set()).add(clauseelement.table.name)
+
+
+@event.listens_for(Engine, "commit")
+def _bump_versions(conn):
+    # Runs just before the DBAPI commit, so the bump commits atomically with the writes.
+    # Tables touched only by a rolled back SAVEPOINT get a harmless extra bump.
+    changed = conn.info.pop("changed_tables", None)
+    if changed:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.executemany(_BUMP_VERSION, [(table,) for table in sorted(changed)])
+        finally:
+            cursor.close()
+
+
+@event.listens_for(Engine, "rollback")
+def _discard_rolled_back(conn):
+    conn.info.pop("changed_tables", None)
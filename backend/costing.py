@@ -0,0 +1,103 @@
+from sqlalchemy import select, update, func, or_, and_, case
+from sqlalchemy.orm import Session
+from typing import Iterable
+from datetime import datetime
+import models
+from measurement import DEFAULT_DROPS_PER_ML
+
+bundles = models.PackageBundle.__table__
+bundle_items = models.package_bundle_items
+packaging_items = models.PackagingItem.__table__
+recipes = models.Recipe.__table__
+recipe_ingredients = models.RecipeIngredient.__table__
+ingredients = models.Ingredient.__table__
+
+
+def recompute_bundle_prices(db: Session, item_ids: Iterable[int]) -> int:
+    """Recompute total_price for every bundle containing one of the given packaging items."""
+    item_ids = list(item_ids)
+    if not item_ids:
+        return 0
+
+    items_price = (
+        select(func.coalesce(func.sum(packaging_items.c.price), 0))
+        .select_from(bundle_items.join(packaging_items, packaging_items.c.id == bundle_items.c.item_id))
+        .where(bundle_items.c.bundle_id == bundles.c.id)
+        .scalar_subquery()
+    )
+    affected = select(bundle_items.c.bundle_id).where(bundle_items.c.item_id.in_(item_ids))
+
+    result = db.connection().execute(
+        update(bundles).where(bundles.c.id.in_(affected)).values(total_price=items_price, updated_at=datetime.utcnow())
+    )
+    return result.rowcount
+
+
+def recompute_line_costs(db: Session, ingredient_ids: Iterable[int]) -> int:
+    """Recompute the stored amount_ml and cost of every recipe line using one of the given ingredients."""
+    ingredient_ids = list(ingredient_ids)
+    if not ingredient_ids:
+        return 0
+
+    def ingredient_column(expression):
+        return select(expression).where(ingredients.c.id == recipe_ingredients.c.ingredient_id).scalar_subquery()
+
+    # Lines entered in drops follow the ingredient's current drop size, like measurement.to_ml
+    drops_per_ml = ingredient_column(func.coalesce(func.nullif(ingredients.c.drops_per_ml, 0), DEFAULT_DROPS_PER_ML))
+    amount_ml = case(
+        (and_(recipe_ingredients.c.unit == "drops", recipe_ingredients.c.amount.isnot(None)),
+         recipe_ingredients.c.amount / drops_per_ml),
+        else_=recipe_ingredients.c.amount_ml,
+    )
+    price = ingredient_column(func.coalesce(ingredients.c.price_per_ml, 0))
+
+    result = db.connection().execute(
+        update(recipe_ingredients)
+        .where(recipe_ingredients.c.ingredient_id.in_(ingredient_ids))
+        .values(amount_ml=amount_ml, cost=amount_ml * price)
+    )
+    return result.rowcount
+
+
+def recompute_recipe_costs(db: Session, ingredient_ids: Iterable[int] = (), item_ids: Iterable[int] = ()) -> int:
+    """Recompute total_cost for every recipe using one of the given ingredients,
+    or packaged in a bundle containing one of the given packaging items.
+
+    Line costs of the given ingredients are refreshed first; recipe totals are
+    then summed from the stored line costs.
+    """
+    ingredient_ids = list(ingredient_ids)
+    item_ids = list(item_ids)
+    if not ingredient_ids and not item_ids:
+        return 0
+
+    if ingredient_ids:
+        recompute_line_costs(db, ingredient_ids)
+
+    ingredients_cost = (
+        select(func.coalesce(func.sum(recipe_ingredients.c.cost), 0))
+        .where(recipe_ingredients.c.recipe_id == recipes.c.id)
+        .scalar_subquery()
+    )
+    packaging_cost = (
+        select(func.coalesce(bundles.c.total_price, 0))
+        .where(bundles.c.id == recipes.c.package_bundle_id)
+        .scalar_subquery()
+    )
+
+    conditions = []
+    if ingredient_ids:
+        conditions.append(recipes.c.id.in_(
+            select(recipe_ingredients.c.recipe_id).where(recipe_ingredients.c.ingredient_id.in_(ingredient_ids))
+        ))
+    if item_ids:
+        conditions.append(recipes.c.package_bundle_id.in_(
+            select(bundle_items.c.bundle_id).where(bundle_items.c.item_id.in_(item_ids))
+        ))
+
+    result = db.connection().execute(
+        update(recipes)
+        .where(or_(*conditions))
+        .values(total_cost=ingredients_cost + func.coalesce(packaging_cost, 0), updated_at=datetime.utcnow())
+    )
+    return result.rowcount
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -8,9 +9,25 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Create the database file in the backend directory
 DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'aromatherapy.db')}"
 
-engine = create_engine(
+def _on_connect(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs work with pysqlite
+    dbapi_connection.isolation_level = None
+    # WAL lets readers proceed while a writer holds the lock
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+def _on_begin(conn):
+    # Transactions opened with execution_options(sqlite_immediate=True) take the write lock up front
+    conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("sqlite_immediate") else "BEGIN")
+
+def configure_engine(engine: Engine) -> Engine:
+    event.listen(engine, "connect", _on_connect)
+    event.listen(engine, "begin", _on_begin)
+    return engine
+
+engine = configure_engine(create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False}
-)
+))
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -20,4 +37,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
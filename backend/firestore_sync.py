@@ -0,0 +1,351 @@
+"""Incremental two-way sync between the SQLite catalog and Firestore.
+
+Unlike migrate_to_firestore.py, which copies everything into fresh documents,
+this keeps a persistent local id <-> document id mapping and per-collection
+checkpoints, so each run only pushes rows whose updated_at moved past the last
+push and only pulls documents whose updatedAt moved past the last pull. When a
+row changed on both sides, the newer timestamp wins. Deletions are not synced.
+
+Each mapping remembers the updated_at both sides last agreed on, so rows that
+were just pulled are not pushed straight back, and rows re-read within
+models.UPDATED_AT_SLACK of the last push are only pushed again if they changed.
+
+The client only needs the small subset of the google-cloud-firestore API used
+below (collection/document/set/where/stream), so the Firestore emulator or an
+in-memory fake can be passed in for tests.
+"""
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+from sqlalchemy.orm import Session
+from database import SessionLocal
+import costing, inventory, measurement, models, schemas, tags
+
+# Referenced collections come first so their document ids exist when needed
+COLLECTIONS = [
+    ("ingredients", models.Ingredient),
+    ("packaging", models.PackagingItem),
+    ("packagingBundles", models.PackageBundle),
+    ("recipes", models.Recipe),
+]
+
+
+def _naive_utc(value) -> Optional[datetime]:
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _price(collection: str, row):
+    # What bundle and recipe costs are derived from
+    if collection == "ingredients":
+        return row.price_per_ml, row.drops_per_ml
+    if collection == "packaging":
+        return row.price
+    return None
+
+
+def _parse_size(size) -> Optional[float]:
+    if not size:
+        return None
+    try:
+        return float(str(size).rstrip("ml").strip())
+    except ValueError:
+        return None
+
+
+class FirestoreSync:
+    def __init__(self, db: Session, client, user_id: str):
+        self.db = db
+        self.client = client
+        self.user_id = user_id
+        db.info["user_id"] = user_id
+
+    # Id mapping and checkpoints
+
+    def _checkpoint(self, collection: str) -> models.SyncCheckpoint:
+        checkpoint = self.db.query(models.SyncCheckpoint).filter(models.SyncCheckpoint.collection == collection).first()
+        if checkpoint is None:
+            checkpoint = models.SyncCheckpoint(collection=collection)
+            self.db.add(checkpoint)
+        return checkpoint
+
+    def _remote_ids(self, collection: str, local_ids: Iterable[int]) -> Dict[int, str]:
+        local_ids = list(local_ids)
+        if not local_ids:
+            return {}
+        return dict(
+            self.db.query(models.SyncMapping.local_id, models.SyncMapping.remote_id).filter(
+                models.SyncMapping.collection == collection,
+                models.SyncMapping.local_id.in_(local_ids),
+            )
+        )
+
+    def _local_ids(self, collection: str, remote_ids: Iterable[str]) -> Dict[str, int]:
+        remote_ids = [remote_id for remote_id in remote_ids if remote_id]
+        if not remote_ids:
+            return {}
+        return dict(
+            self.db.query(models.SyncMapping.remote_id, models.SyncMapping.local_id).filter(
+                models.SyncMapping.collection == collection,
+                models.SyncMapping.remote_id.in_(remote_ids),
+            )
+        )
+
+    def _mappings(self, collection: str, local_ids: Iterable[int]) -> Dict[int, models.SyncMapping]:
+        local_ids = list(local_ids)
+        if not local_ids:
+            return {}
+        return {
+            mapping.local_id: mapping
+            for mapping in self.db.query(models.SyncMapping).filter(
+                models.SyncMapping.collection == collection,
+                models.SyncMapping.local_id.in_(local_ids),
+            )
+        }
+
+    def _map(self, collection: str, local_id: int, remote_id: str,
+             synced_at: Optional[datetime] = None) -> models.SyncMapping:
+        mapping = models.SyncMapping(collection=collection, local_id=local_id, remote_id=remote_id, synced_at=synced_at)
+        self.db.add(mapping)
+        return mapping
+
+    # Local row -> Firestore document
+
+    def _to_doc(self, collection: str, row) -> dict:
+        doc = {
+            "userId": self.user_id,
+            "name": row.name,
+            "notes": row.notes or "",
+            "description": row.description or "",
+            "updatedAt": row.updated_at.replace(tzinfo=timezone.utc),
+        }
+        if collection == "ingredients":
+            doc.update({
+                "type": row.type,
+                "measurementUnit": row.measurement_type or "ml",
+                "stockQuantity": row.stock_amount or 0.0,
+                "costPerUnit": row.price_per_ml or 0.0,
+                "properties": row.properties or "",
+                "dropsPerMl": row.drops_per_ml,
+            })
+        elif collection == "packaging":
+            doc.update({
+                "type": row.type,
+                "size": f"{row.capacity}ml" if row.capacity else None,
+                "stockQuantity": row.stock_amount or 0,
+                "costPerUnit": row.price or 0.0,
+                "color": row.color,
+                "material": row.material,
+            })
+        elif collection == "packagingBundles":
+            packaging_ids = self._remote_ids("packaging", [item.id for item in row.items])
+            doc.update({
+                "components": [
+                    {"packagingId": packaging_ids.get(item.id), "quantity": 1, "type": item.type}
+                    for item in row.items
+                ],
+                "totalCost": row.total_price or 0.0,
+                "capacity": row.capacity,
+            })
+        elif collection == "recipes":
+            ingredient_ids = self._remote_ids("ingredients", [line.ingredient_id for line in row.recipe_ingredients])
+            bundle_ids = self._remote_ids("packagingBundles", [row.package_bundle_id] if row.package_bundle_id else [])
+            doc.update({
+                "totalVolume": row.total_volume_ml,
+                "measurementUnit": "ml",
+                "ingredients": [
+                    {
+                        "ingredientId": ingredient_ids.get(line.ingredient_id),
+                        "quantity": line.amount if line.amount is not None else line.amount_ml,
+                        "measurementUnit": line.unit or "ml",
+                    }
+                    for line in row.recipe_ingredients
+                ],
+                "packagingBundleId": bundle_ids.get(row.package_bundle_id),
+                "retailPrice": row.retail_price or 0.0,
+                "totalCost": row.total_cost or 0.0,
+            })
+        return doc
+
+    # Firestore document -> local row
+
+    def _apply_doc(self, collection: str, row, data: dict):
+        row.name = data.get("name")
+        row.notes = data.get("notes") or None
+        row.description = data.get("description") or ""
+        if collection == "ingredients":
+            row.type = data.get("type")
+            row.measurement_type = data.get("measurementUnit") or "ml"
+            row.price_per_ml = data.get("costPerUnit")
+            row.properties = data.get("properties") or ""
+            tags.sync_ingredient_tags(self.db, row)
+            row.drops_per_ml = data.get("dropsPerMl")
+            self._apply_stock("ingredient", row, data.get("stockQuantity") or 0)
+        elif collection == "packaging":
+            row.type = data.get("type")
+            row.capacity = _parse_size(data.get("size"))
+            row.price = data.get("costPerUnit")
+            row.color = data.get("color")
+            row.material = data.get("material")
+            self._apply_stock("packaging", row, data.get("stockQuantity") or 0)
+        elif collection == "packagingBundles":
+            item_ids = self._local_ids("packaging", [c.get("packagingId") for c in data.get("components") or []])
+            items = self.db.query(models.PackagingItem).filter(models.PackagingItem.id.in_(item_ids.values())).all()
+            row.items = items
+            row.capacity = data.get("capacity")
+            row.total_price = sum(item.price or 0 for item in items)
+        elif collection == "recipes":
+            lines = data.get("ingredients") or []
+            ingredient_ids = self._local_ids("ingredients", [line.get("ingredientId") for line in lines])
+            bundle_ids = self._local_ids("packagingBundles", [data.get("packagingBundleId")])
+            bundle = self.db.query(models.PackageBundle).filter(
+                models.PackageBundle.id == bundle_ids.get(data.get("packagingBundleId"))
+            ).first()
+            converted = measurement.convert_lines(self.db, [
+                schemas.RecipeIngredientBase(
+                    ingredient_id=ingredient_ids[line.get("ingredientId")],
+                    amount=line.get("quantity") or 0,
+                    unit="drops" if line.get("measurementUnit") == "drops" else "ml",
+                )
+                for line in lines if line.get("ingredientId") in ingredient_ids
+            ])
+            row.total_volume_ml = data.get("totalVolume")
+            row.retail_price = data.get("retailPrice")
+            row.package_bundle_id = bundle.id if bundle else None
+            # Cost from local prices, like create_recipe
+            row.total_cost = sum(line.cost for line in converted) + (bundle.total_price or 0 if bundle else 0)
+            if row.id is None:
+                self.db.flush()
+            self.db.query(models.RecipeIngredient).filter(models.RecipeIngredient.recipe_id == row.id).delete()
+            for line in converted:
+                self.db.add(measurement.recipe_ingredient(row.id, line))
+
+    def _apply_stock(self, item_kind: str, row, stock):
+        # Remote stock changes go through the ledger like any other adjustment
+        previous_stock = row.stock_amount or 0
+        row.stock_amount = stock
+        if row.id is None:
+            self.db.flush()
+            previous_stock = 0
+        if stock != previous_stock:
+            inventory.record_movement(self.db, item_kind, row.id, "adjust", stock - previous_stock,
+                                      previous_stock=previous_stock, notes="Firestore sync")
+
+    # Sync
+
+    def push(self) -> Dict[str, int]:
+        """Write rows changed since the last push to Firestore."""
+        pushed = {}
+        for collection, model in COLLECTIONS:
+            checkpoint = self._checkpoint(collection)
+            query = self.db.query(model)
+            if checkpoint.pushed_at is not None:
+                query = query.filter(model.updated_at > checkpoint.pushed_at - models.UPDATED_AT_SLACK)
+            rows = query.order_by(model.updated_at).all()
+
+            mappings = self._mappings(collection, [row.id for row in rows])
+            count = 0
+            for row in rows:
+                mapping = mappings.get(row.id)
+                # Already pushed, or just pulled, at this version
+                if mapping is not None and row.updated_at == mapping.synced_at:
+                    continue
+                if mapping is None:
+                    mapping = self._map(collection, row.id, self.client.collection(collection).document().id)
+                    self.db.flush()
+                self.client.collection(collection).document(mapping.remote_id).set(self._to_doc(collection, row))
+                mapping.synced_at = row.updated_at
+                count += 1
+
+            if rows and (checkpoint.pushed_at is None or rows[-1].updated_at > checkpoint.pushed_at):
+                checkpoint.pushed_at = rows[-1].updated_at
+            self.db.commit()
+            pushed[collection] = count
+        return pushed
+
+    def pull(self) -> Dict[str, int]:
+        """Apply Firestore documents changed since the last pull, unless the local row is newer."""
+        pulled = {}
+        for collection, model in COLLECTIONS:
+            checkpoint = self._checkpoint(collection)
+            query = self.client.collection(collection).where("userId", "==", self.user_id)
+            if checkpoint.pulled_at is not None:
+                query = query.where("updatedAt", ">", checkpoint.pulled_at.replace(tzinfo=timezone.utc))
+            docs = [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+            local_ids = self._local_ids(collection, [doc_id for doc_id, _ in docs])
+            applied = []
+            repriced = []
+            newest = checkpoint.pulled_at
+            for doc_id, data in docs:
+                remote_updated = _naive_utc(data.get("updatedAt"))
+                if remote_updated is None:
+                    continue
+                newest = remote_updated if newest is None else max(newest, remote_updated)
+
+                local_id = local_ids.get(doc_id)
+                if local_id is None:
+                    row = model()
+                    self.db.add(row)
+                else:
+                    row = self.db.query(model).filter(model.id == local_id).first()
+                    # Deleted locally, or changed locally after the remote edit: local wins
+                    if row is None or row.updated_at >= remote_updated:
+                        continue
+
+                price = _price(collection, row)
+                self._apply_doc(collection, row, data)
+                row.updated_at = remote_updated
+                self.db.flush()
+                # Both sides now hold this version, so push() leaves the row alone
+                if local_id is None:
+                    self._map(collection, row.id, doc_id, synced_at=remote_updated)
+                else:
+                    self._mappings(collection, [row.id])[row.id].synced_at = remote_updated
+                applied.append(row.id)
+                # New rows are not used anywhere yet
+                if local_id is not None and _price(collection, row) != price:
+                    repriced.append(row.id)
+
+            # Pulled prices flow into bundle and recipe costs; other edits leave them, and their updated_at, alone
+            if collection == "ingredients":
+                costing.recompute_recipe_costs(self.db, repriced)
+            elif collection == "packaging":
+                costing.recompute_bundle_prices(self.db, repriced)
+                costing.recompute_recipe_costs(self.db, item_ids=repriced)
+
+            checkpoint.pulled_at = newest
+            self.db.commit()
+            pulled[collection] = len(applied)
+        return pulled
+
+    def sync(self) -> Dict[str, Dict[str, int]]:
+        pulled = self.pull()
+        pushed = self.push()
+        return {"pulled": pulled, "pushed": pushed}
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: python firestore_sync.py <firebase-user-id> <service-account.json>")
+        sys.exit(1)
+    user_id, credentials_path = sys.argv[1], sys.argv[2]
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+
+    db = SessionLocal()
+    try:
+        result = FirestoreSync(db, firestore.client(), user_id).sync()
+        print(f"Pulled: {result['pulled']}")
+        print(f"Pushed: {result['pushed']}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
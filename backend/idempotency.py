@@ -0,0 +1,237 @@
+"""Idempotency-Key support for POST/PUT/PATCH requests.
+
+The first request with a given key claims it by inserting an in-progress row
+into idempotency_keys; its response is stored there once it finishes. A retry
+with the same key gets the stored response back without running the handler
+again, headers included. A duplicate arriving while the first is still running waits for it:
+within a worker on an in-process event, across workers by polling the row.
+
+Keys are scoped per tenant and expire after KEY_TTL. A claim whose request
+never finished (the worker died) is taken over after CLAIM_TIMEOUT. Server
+errors (5xx) and 429 rejections are not stored, so a retry after one runs the
+handler again.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+from sqlalchemy import and_, delete, insert, or_, select, update
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from database import get_db
+from tenancy import DEFAULT_TENANT
+import models
+
+HEADER = "idempotency-key"
+METHODS = ("POST", "PUT", "PATCH")
+MAX_KEY_LENGTH = 255
+KEY_TTL = timedelta(hours=24)
+CLAIM_TIMEOUT = timedelta(seconds=60)
+# How long a duplicate waits for the first request before giving up with 409
+WAIT_TIMEOUT = 30.0
+POLL_INTERVAL = 0.05
+# Expired keys are purged on every PURGE_EVERY-th claim
+PURGE_EVERY = 100
+
+CLAIMED, IN_PROGRESS, COMPLETED, MISMATCH = "claimed", "in_progress", "completed", "mismatch"
+
+keys = models.IdempotencyKey.__table__
+
+
+def fingerprint(method: str, path: str, query: bytes, body: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query, body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()[:32]
+
+
+class KeyStore:
+    def __init__(self):
+        self._claims = 0
+
+    def claim(self, db, user_id: str, key: str, request_fingerprint: str) -> Tuple[str, Optional[tuple]]:
+        """Claim the key for a new request, or report the state of the request that holds it."""
+        now = datetime.utcnow()
+        this_key = and_(keys.c.user_id == user_id, keys.c.key == key)
+        live = or_(
+            keys.c.status_code.isnot(None) & (keys.c.created_at >= now - KEY_TTL),
+            keys.c.status_code.is_(None) & (keys.c.created_at >= now - CLAIM_TIMEOUT),
+        )
+        current = select(
+            keys.c.fingerprint, keys.c.status_code, keys.c.content_type, keys.c.headers, keys.c.body
+        ).where(this_key, live)
+        # Retries and waiting duplicates only read; writing is left to the first request
+        row = db.connection().execute(current).first()
+        db.commit()
+        if row is None:
+            # A fresh transaction that starts with a write waits for the lock, where
+            # upgrading the read above could fail at once under WAL
+            conn = db.connection()
+            self._claims += 1
+            if self._claims % PURGE_EVERY == 0:
+                conn.execute(delete(keys).where(keys.c.created_at < now - KEY_TTL))
+            # An expired key, or an abandoned claim, can be claimed again
+            conn.execute(delete(keys).where(this_key, ~live))
+            inserted = conn.execute(
+                insert(keys).prefix_with("OR IGNORE").values(
+                    user_id=user_id, key=key, fingerprint=request_fingerprint, created_at=now,
+                )
+            ).rowcount
+            if not inserted:
+                row = conn.execute(current).first()
+            db.commit()
+
+        if row is None:
+            return CLAIMED, None
+        if row.fingerprint != request_fingerprint:
+            return MISMATCH, None
+        if row.status_code is None:
+            return IN_PROGRESS, None
+        return COMPLETED, (row.status_code, row.content_type, row.headers, row.body)
+
+    def complete(self, db, user_id: str, key: str, status_code: int, content_type: Optional[str],
+                 headers: str, body: bytes):
+        db.connection().execute(
+            update(keys)
+            .where(keys.c.user_id == user_id, keys.c.key == key)
+            .values(status_code=status_code, content_type=content_type, headers=headers, body=body)
+        )
+        db.commit()
+
+    def release(self, db, user_id: str, key: str):
+        db.connection().execute(delete(keys).where(keys.c.user_id == user_id, keys.c.key == key))
+        db.commit()
+
+
+@contextmanager
+def _session(app):
+    # Same session provider as the request handlers, including test overrides of get_db
+    provider = app.dependency_overrides.get(get_db, get_db)
+    sessions = provider()
+    try:
+        yield next(sessions)
+    finally:
+        sessions.close()
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.store = KeyStore()
+        self._running: Dict[tuple, asyncio.Event] = {}
+
+    async def _store(self, scope, method, *args):
+        def run():
+            with _session(scope["app"]) as db:
+                return getattr(self.store, method)(db, *args)
+        return await run_in_threadpool(run)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in METHODS:
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        key = headers.get(HEADER)
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse({"detail": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"}, status_code=400)
+            return await response(scope, receive, send)
+
+        # Buffer the body so it can be fingerprinted and then replayed to the handler
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        user_id = headers.get("x-user-id", DEFAULT_TENANT)
+        running_key = (user_id, key)
+        request_fingerprint = fingerprint(scope["method"], scope["path"], scope.get("query_string", b""), body)
+
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while True:
+            event = self._running.get(running_key)
+            if event is not None:
+                # Duplicate within this worker: wait for the first request to finish
+                try:
+                    await asyncio.wait_for(event.wait(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+            state, stored = await self._store(scope, "claim", user_id, key, request_fingerprint)
+            if state != IN_PROGRESS:
+                break
+            if time.monotonic() >= deadline:
+                response = JSONResponse(
+                    {"detail": "A request with this Idempotency-Key is still in progress"},
+                    status_code=409, headers={"Retry-After": "1"},
+                )
+                return await response(scope, receive, send)
+            if running_key not in self._running:
+                # Running in another worker
+                await asyncio.sleep(POLL_INTERVAL)
+
+        if state == MISMATCH:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key was already used for a different request"}, status_code=422
+            )
+            return await response(scope, receive, send)
+        if state == COMPLETED:
+            status_code, content_type, stored_headers, stored_body = stored
+            response = Response(stored_body, status_code=status_code, media_type=content_type)
+            if stored_headers is not None:
+                # Raw pairs, so repeated headers such as Set-Cookie survive
+                response.raw_headers = [
+                    (name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(stored_headers)
+                ]
+            response.headers["Idempotent-Replayed"] = "true"
+            return await response(scope, receive, send)
+
+        self._running[running_key] = asyncio.Event()
+        try:
+            await self._run(scope, body, receive, send, user_id, key)
+        finally:
+            self._running.pop(running_key).set()
+
+    async def _run(self, scope, body, receive, send, user_id, key):
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # The body was consumed; from here on the client can only disconnect
+            return await receive()
+
+        status_code = None
+        content_type = None
+        raw_headers = []
+        chunks = []
+
+        async def capture(message):
+            nonlocal status_code, content_type, raw_headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                raw_headers = message.get("headers", [])
+                content_type = Headers(raw=raw_headers).get("content-type")
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay, capture)
+        except BaseException:
+            await self._store(scope, "release", user_id, key)
+            raise
+        # Server errors and load shedding are transient: the retry should run the handler
+        if status_code is None or status_code >= 500 or status_code == 429:
+            await self._store(scope, "release", user_id, key)
+        else:
+            headers = json.dumps([[name.decode("latin-1"), value.decode("latin-1")] for name, value in raw_headers])
+            await self._store(scope, "complete", user_id, key, status_code, content_type, headers, b"".join(chunks))
@@ -0,0 +1,123 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import models
+
+# Write a snapshot once an item's ledger tail reaches this many movements, so
+# stock lookups never sum more than this many rows
+SNAPSHOT_INTERVAL = 500
+
+ITEM_MODELS = {
+    "ingredient": models.Ingredient,
+    "packaging": models.PackagingItem,
+}
+
+
+def _latest_snapshot(db: Session, item_kind: str, item_id: int, at: Optional[datetime] = None):
+    query = db.query(models.StockSnapshot).filter(
+        models.StockSnapshot.item_kind == item_kind,
+        models.StockSnapshot.item_id == item_id,
+    )
+    if at is not None:
+        query = query.filter(models.StockSnapshot.as_of <= at)
+    return query.order_by(models.StockSnapshot.as_of.desc(), models.StockSnapshot.id.desc()).first()
+
+
+def _tail(db: Session, item_kind: str, item_id: int, after_movement_id: int, at: Optional[datetime] = None):
+    query = db.query(
+        func.count(models.StockMovement.id),
+        func.coalesce(func.sum(models.StockMovement.quantity), 0),
+        func.max(models.StockMovement.id),
+        func.max(models.StockMovement.created_at),
+    ).filter(
+        models.StockMovement.item_kind == item_kind,
+        models.StockMovement.item_id == item_id,
+        models.StockMovement.id > after_movement_id,
+    )
+    if at is not None:
+        query = query.filter(models.StockMovement.created_at <= at)
+    return query.one()
+
+
+def record_movement(db: Session, item_kind: str, item_id: int, kind: str, quantity: float,
+                    previous_stock: Optional[float] = None, notes: Optional[str] = None) -> models.StockMovement:
+    """Append a movement to the ledger.
+
+    The caller keeps the item's stock_amount column in step; previous_stock is
+    the stock before this movement and opens the ledger for items that predate it.
+    """
+    snapshot = _latest_snapshot(db, item_kind, item_id)
+    if snapshot is None:
+        db.add(models.StockSnapshot(
+            item_kind=item_kind,
+            item_id=item_id,
+            quantity=previous_stock or 0,
+            last_movement_id=0,
+            as_of=datetime.utcnow(),
+        ))
+
+    movement = models.StockMovement(item_kind=item_kind, item_id=item_id, kind=kind, quantity=quantity, notes=notes)
+    db.add(movement)
+    db.flush()
+
+    if snapshot is not None:
+        count, total, last_id, last_at = _tail(db, item_kind, item_id, snapshot.last_movement_id)
+        if count >= SNAPSHOT_INTERVAL:
+            db.add(models.StockSnapshot(
+                user_id=movement.user_id,
+                item_kind=item_kind,
+                item_id=item_id,
+                quantity=snapshot.quantity + total,
+                last_movement_id=last_id,
+                as_of=last_at,
+            ))
+    return movement
+
+
+def stock_at(db: Session, item_kind: str, item_id: int, at: Optional[datetime] = None) -> Optional[float]:
+    """Stock for an item from its latest snapshot plus the ledger tail, optionally as of a point in time.
+
+    Returns None when the ledger has no history for the item at that time.
+    """
+    snapshot = _latest_snapshot(db, item_kind, item_id, at)
+    if snapshot is None:
+        return None
+    _, total, _, _ = _tail(db, item_kind, item_id, snapshot.last_movement_id, at)
+    return snapshot.quantity + total
+
+
+def compact(db: Session) -> int:
+    """Write a fresh snapshot for every item with movements after its latest snapshot."""
+    latest = (
+        db.query(func.max(models.StockSnapshot.id).label("id"))
+        .group_by(models.StockSnapshot.user_id, models.StockSnapshot.item_kind, models.StockSnapshot.item_id)
+        .subquery()
+    )
+    tails = (
+        db.query(
+            models.StockSnapshot,
+            func.sum(models.StockMovement.quantity),
+            func.max(models.StockMovement.id),
+            func.max(models.StockMovement.created_at),
+        )
+        .join(latest, latest.c.id == models.StockSnapshot.id)
+        .join(models.StockMovement, (models.StockMovement.user_id == models.StockSnapshot.user_id)
+              & (models.StockMovement.item_kind == models.StockSnapshot.item_kind)
+              & (models.StockMovement.item_id == models.StockSnapshot.item_id)
+              & (models.StockMovement.id > models.StockSnapshot.last_movement_id))
+        .group_by(models.StockSnapshot.id)
+        .all()
+    )
+
+    for snapshot, total, last_id, last_at in tails:
+        db.add(models.StockSnapshot(
+            user_id=snapshot.user_id,
+            item_kind=snapshot.item_kind,
+            item_id=snapshot.item_id,
+            quantity=snapshot.quantity + total,
+            last_movement_id=last_id,
+            as_of=last_at,
+        ))
+    db.flush()
+    return len(tails)
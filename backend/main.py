@@ -1,13 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
+from sqlalchemy import update, bindparam, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import os
+import secrets
+import tempfile
+import time
+from datetime import datetime
 import models, schemas
-from database import engine, get_db
+import admission, backup, costing, inventory, measurement, migrations, production, reports, similarity, tags, write_queue
+from cache import cache
+from database import get_db
+from idempotency import IdempotencyMiddleware
+from metrics import latency
+from storage import Storage, file_storage
+from tenancy import get_tenant_db
+from write_queue import run_write
 from fastapi.middleware.cors import CORSMiddleware
 
-models.Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="AromaDB API")
+router = APIRouter()
 
 # Configure CORS
 origins = [
@@ -16,204 +30,455 @@ origins = [
     "*"                      # Allow all origins in development
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-)
+async def record_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    latency.record(time.perf_counter() - started)
+    return response
+
+# Expensive routes are admitted through bounded gates, see admission.py
+LIST_GATE = [Depends(admission.admit("lists", admission.page_cost))]
+RECIPE_LIST_GATE = [Depends(admission.admit("recipe_lists", admission.page_cost))]
+REPORT_GATE = [Depends(admission.admit("reports"))]
+EXPORT_GATE = [Depends(admission.admit("exports"))]
+
+# Backups hold every tenant's data; the admin routes are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get("AROMADB_ADMIN_TOKEN")
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+ADMIN_GATE = [Depends(require_admin)] + EXPORT_GATE
+
+def integrity_error(request: Request, exc: IntegrityError):
+    # Unique names are per tenant; a duplicate (e.g. a retried create) is a conflict, not a server error
+    if "UNIQUE constraint failed" in str(exc.orig):
+        detail = "A record with this name already exists" if ".name" in str(exc.orig) else "Conflicts with an existing record"
+        return JSONResponse(status_code=409, content={"detail": detail})
+    return JSONResponse(status_code=500, content={"detail": "Integrity error"})
 
 # Ingredient endpoints
-@app.post("/ingredients/", response_model=schemas.Ingredient)
-def create_ingredient(ingredient: schemas.IngredientCreate, db: Session = Depends(get_db)):
-    db_ingredient = models.Ingredient(**ingredient.dict())
-    db.add(db_ingredient)
-    db.commit()
-    db.refresh(db_ingredient)
-    return db_ingredient
-
-@app.get("/ingredients/", response_model=List[schemas.Ingredient])
-def read_ingredients(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.post("/ingredients/", response_model=schemas.Ingredient)
+def create_ingredient(ingredient: schemas.IngredientCreate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        db_ingredient = models.Ingredient(**ingredient.dict())
+        db.add(db_ingredient)
+        tags.sync_ingredient_tags(db, db_ingredient)
+        db.flush()
+        if db_ingredient.stock_amount:
+            inventory.record_movement(db, "ingredient", db_ingredient.id, "receive", db_ingredient.stock_amount,
+                                      previous_stock=0)
+        db.refresh(db_ingredient)
+        return schemas.Ingredient.model_validate(db_ingredient)
+
+    return run_write(db, mutation)
+
+@router.get("/ingredients/", response_model=List[schemas.Ingredient], dependencies=LIST_GATE)
+def read_ingredients(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
     ingredients = db.query(models.Ingredient).offset(skip).limit(limit).all()
     return ingredients
 
-@app.get("/ingredients/{ingredient_id}", response_model=schemas.Ingredient)
-def read_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
-    ingredient = db.query(models.Ingredient).filter(models.Ingredient.id == ingredient_id).first()
-    if ingredient is None:
-        raise HTTPException(status_code=404, detail="Ingredient not found")
-    return ingredient
+def _tag_names(properties: List[str]) -> List[str]:
+    # Distinct tags: ingredients_with_tags(match_all=True) compares the match count with len(names)
+    return list(dict.fromkeys(name for text in properties for name in tags.parse_properties(text)))
 
-@app.put("/ingredients/{ingredient_id}", response_model=schemas.Ingredient)
-def update_ingredient(ingredient_id: int, ingredient: schemas.IngredientCreate, db: Session = Depends(get_db)):
-    db_ingredient = db.query(models.Ingredient).filter(models.Ingredient.id == ingredient_id).first()
-    if db_ingredient is None:
-        raise HTTPException(status_code=404, detail="Ingredient not found")
-    
-    for key, value in ingredient.dict().items():
-        setattr(db_ingredient, key, value)
+@router.get("/ingredients/filter", response_model=schemas.IngredientFilterResult, dependencies=LIST_GATE)
+def filter_ingredients(
+    properties: List[str] = Query([]),
+    type: Optional[str] = None,
+    match: str = Query("all", pattern="^(all|any)$"),
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
+    query = db.query(models.Ingredient.id)
+    names = _tag_names(properties)
+    if names:
+        query = query.filter(models.Ingredient.id.in_(tags.ingredients_with_tags(db, names, match == "all")))
+    if type is not None:
+        query = query.filter(models.Ingredient.type == type)
+    ids = query.scalar_subquery()
     
-    db.commit()
-    db.refresh(db_ingredient)
-    return db_ingredient
+    items = (
+        db.query(models.Ingredient)
+        .filter(models.Ingredient.id.in_(ids))
+        .order_by(models.Ingredient.id)
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    return schemas.IngredientFilterResult(
+        total=query.count(),
+        items=items,
+        facets={
+            "properties": tags.tag_counts(db, ids),
+            "type": tags.facet_counts(db, models.Ingredient.type, ids),
+        },
+    )
 
-@app.delete("/ingredients/{ingredient_id}")
-def delete_ingredient(ingredient_id: int, db: Session = Depends(get_db)):
+@router.get("/ingredients/{ingredient_id}", response_model=schemas.Ingredient)
+def read_ingredient(ingredient_id: int, db: Session = Depends(get_tenant_db)):
     ingredient = db.query(models.Ingredient).filter(models.Ingredient.id == ingredient_id).first()
     if ingredient is None:
         raise HTTPException(status_code=404, detail="Ingredient not found")
-    
-    db.delete(ingredient)
-    db.commit()
+    return ingredient
+
+@router.put("/ingredients/{ingredient_id}", response_model=schemas.Ingredient)
+def update_ingredient(ingredient_id: int, ingredient: schemas.IngredientCreate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        db_ingredient = db.query(models.Ingredient).filter(models.Ingredient.id == ingredient_id).first()
+        if db_ingredient is None:
+            raise HTTPException(status_code=404, detail="Ingredient not found")
+        
+        previous_stock = db_ingredient.stock_amount or 0
+        previous_conversion = (db_ingredient.price_per_ml, db_ingredient.drops_per_ml)
+        for key, value in ingredient.dict().items():
+            setattr(db_ingredient, key, value)
+        tags.sync_ingredient_tags(db, db_ingredient)
+        
+        # Stored line amounts and costs depend on price and drop size
+        if (db_ingredient.price_per_ml, db_ingredient.drops_per_ml) != previous_conversion:
+            db.flush()
+            costing.recompute_recipe_costs(db, [ingredient_id])
+        
+        # Record stock changes in the ledger instead of losing the old value
+        if (db_ingredient.stock_amount or 0) != previous_stock:
+            inventory.record_movement(db, "ingredient", ingredient_id, "adjust",
+                                      (db_ingredient.stock_amount or 0) - previous_stock, previous_stock=previous_stock)
+        db.flush()
+        db.refresh(db_ingredient)
+        return schemas.Ingredient.model_validate(db_ingredient)
+
+    return run_write(db, mutation)
+
+@router.delete("/ingredients/{ingredient_id}")
+def delete_ingredient(ingredient_id: int, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        ingredient = db.query(models.Ingredient).filter(models.Ingredient.id == ingredient_id).first()
+        if ingredient is None:
+            raise HTTPException(status_code=404, detail="Ingredient not found")
+        # Recipe lines are keyed by ingredient; removing it would leave them dangling
+        if db.query(models.RecipeIngredient.recipe_id).filter(models.RecipeIngredient.ingredient_id == ingredient_id).first():
+            raise HTTPException(status_code=409, detail="Ingredient is used in recipes")
+        db.delete(ingredient)
+
+    run_write(db, mutation)
     return {"message": "Ingredient deleted successfully"}
 
 # Packaging Item endpoints
-@app.post("/packaging-items/", response_model=schemas.PackagingItem)
-def create_packaging_item(item: schemas.PackagingItemCreate, db: Session = Depends(get_db)):
-    db_item = models.PackagingItem(**item.dict())
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
-    return db_item
-
-@app.get("/packaging-items/", response_model=List[schemas.PackagingItem])
-def read_packaging_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.post("/packaging-items/", response_model=schemas.PackagingItem)
+def create_packaging_item(item: schemas.PackagingItemCreate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        db_item = models.PackagingItem(**item.dict())
+        db.add(db_item)
+        db.flush()
+        if db_item.stock_amount:
+            inventory.record_movement(db, "packaging", db_item.id, "receive", db_item.stock_amount, previous_stock=0)
+        db.refresh(db_item)
+        return schemas.PackagingItem.model_validate(db_item)
+
+    return run_write(db, mutation)
+
+@router.get("/packaging-items/", response_model=List[schemas.PackagingItem], dependencies=LIST_GATE)
+def read_packaging_items(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
     items = db.query(models.PackagingItem).offset(skip).limit(limit).all()
     return items
 
-@app.get("/packaging-items/{item_id}", response_model=schemas.PackagingItem)
-def read_packaging_item(item_id: int, db: Session = Depends(get_db)):
+@router.get("/packaging-items/filter", response_model=schemas.PackagingItemFilterResult, dependencies=LIST_GATE)
+def filter_packaging_items(
+    type: Optional[str] = None,
+    material: Optional[str] = None,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
+    query = db.query(models.PackagingItem.id)
+    if type is not None:
+        query = query.filter(models.PackagingItem.type == type)
+    if material is not None:
+        query = query.filter(models.PackagingItem.material == material)
+    ids = query.scalar_subquery()
+    
+    items = (
+        db.query(models.PackagingItem)
+        .filter(models.PackagingItem.id.in_(ids))
+        .order_by(models.PackagingItem.id)
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    return schemas.PackagingItemFilterResult(
+        total=query.count(),
+        items=items,
+        facets={
+            "type": tags.facet_counts(db, models.PackagingItem.type, ids),
+            "material": tags.facet_counts(db, models.PackagingItem.material, ids),
+        },
+    )
+
+@router.get("/packaging-items/{item_id}", response_model=schemas.PackagingItem)
+def read_packaging_item(item_id: int, db: Session = Depends(get_tenant_db)):
     item = db.query(models.PackagingItem).filter(models.PackagingItem.id == item_id).first()
     if item is None:
         raise HTTPException(status_code=404, detail="Packaging item not found")
     return item
 
-@app.put("/packaging-items/{item_id}", response_model=schemas.PackagingItem)
-def update_packaging_item(item_id: int, item: schemas.PackagingItemCreate, db: Session = Depends(get_db)):
-    db_item = db.query(models.PackagingItem).filter(models.PackagingItem.id == item_id).first()
-    if db_item is None:
-        raise HTTPException(status_code=404, detail="Packaging item not found")
-    
-    for key, value in item.dict().items():
-        setattr(db_item, key, value)
-    
-    db.commit()
-    db.refresh(db_item)
-    return db_item
+@router.put("/packaging-items/{item_id}", response_model=schemas.PackagingItem)
+def update_packaging_item(item_id: int, item: schemas.PackagingItemCreate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        db_item = db.query(models.PackagingItem).filter(models.PackagingItem.id == item_id).first()
+        if db_item is None:
+            raise HTTPException(status_code=404, detail="Packaging item not found")
+        
+        previous_stock = db_item.stock_amount or 0
+        for key, value in item.dict().items():
+            setattr(db_item, key, value)
+        
+        # Record stock changes in the ledger instead of losing the old value
+        if (db_item.stock_amount or 0) != previous_stock:
+            inventory.record_movement(db, "packaging", item_id, "adjust",
+                                      (db_item.stock_amount or 0) - previous_stock, previous_stock=previous_stock)
+        db.flush()
+        db.refresh(db_item)
+        return schemas.PackagingItem.model_validate(db_item)
 
-@app.delete("/packaging-items/{item_id}")
-def delete_packaging_item(item_id: int, db: Session = Depends(get_db)):
-    item = db.query(models.PackagingItem).filter(models.PackagingItem.id == item_id).first()
-    if item is None:
-        raise HTTPException(status_code=404, detail="Packaging item not found")
-    
-    db.delete(item)
-    db.commit()
+    return run_write(db, mutation)
+
+@router.delete("/packaging-items/{item_id}")
+def delete_packaging_item(item_id: int, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        item = db.query(models.PackagingItem).filter(models.PackagingItem.id == item_id).first()
+        if item is None:
+            raise HTTPException(status_code=404, detail="Packaging item not found")
+        db.delete(item)
+
+    run_write(db, mutation)
     return {"message": "Packaging item deleted successfully"}
 
+# Batch price endpoints
+@router.patch("/prices/batch", response_model=schemas.BatchPriceUpdateResult)
+def batch_update_prices(batch: schemas.BatchPriceUpdate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        ingredient_ids = [change.id for change in batch.ingredients]
+        item_ids = [change.id for change in batch.packaging_items]
+
+        # Make sure every referenced row exists before touching anything
+        if ingredient_ids:
+            ingredient_stock = dict(
+                db.query(models.Ingredient.id, models.Ingredient.stock_amount)
+                .filter(models.Ingredient.id.in_(ingredient_ids))
+            )
+            missing = sorted(set(ingredient_ids) - set(ingredient_stock))
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Ingredients not found: {missing}")
+        if item_ids:
+            item_stock = dict(
+                db.query(models.PackagingItem.id, models.PackagingItem.stock_amount)
+                .filter(models.PackagingItem.id.in_(item_ids))
+            )
+            missing = sorted(set(item_ids) - set(item_stock))
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Packaging items not found: {missing}")
+
+        ingredients = models.Ingredient.__table__
+        packaging_items = models.PackagingItem.__table__
+        connection = db.connection()
+
+        # Apply all changes with one executemany per table; omitted fields keep their value
+        if batch.ingredients:
+            connection.execute(
+                update(ingredients)
+                .where(ingredients.c.id == bindparam("b_id"))
+                .values(
+                    price_per_ml=func.coalesce(bindparam("b_price_per_ml"), ingredients.c.price_per_ml),
+                    stock_amount=func.coalesce(bindparam("b_stock_amount"), ingredients.c.stock_amount),
+                    updated_at=datetime.utcnow(),
+                ),
+                [
+                    {"b_id": c.id, "b_price_per_ml": c.price_per_ml, "b_stock_amount": c.stock_amount}
+                    for c in batch.ingredients
+                ],
+            )
+        if batch.packaging_items:
+            connection.execute(
+                update(packaging_items)
+                .where(packaging_items.c.id == bindparam("b_id"))
+                .values(
+                    price=func.coalesce(bindparam("b_price"), packaging_items.c.price),
+                    stock_amount=func.coalesce(bindparam("b_stock_amount"), packaging_items.c.stock_amount),
+                    updated_at=datetime.utcnow(),
+                ),
+                [
+                    {"b_id": c.id, "b_price": c.price, "b_stock_amount": c.stock_amount}
+                    for c in batch.packaging_items
+                ],
+            )
+
+        # Record stock changes in the ledger
+        for change in batch.ingredients:
+            previous_stock = ingredient_stock[change.id] or 0
+            if change.stock_amount is not None and change.stock_amount != previous_stock:
+                inventory.record_movement(db, "ingredient", change.id, "adjust",
+                                          change.stock_amount - previous_stock, previous_stock=previous_stock)
+                ingredient_stock[change.id] = change.stock_amount
+        for change in batch.packaging_items:
+            previous_stock = item_stock[change.id] or 0
+            if change.stock_amount is not None and change.stock_amount != previous_stock:
+                inventory.record_movement(db, "packaging", change.id, "adjust",
+                                          change.stock_amount - previous_stock, previous_stock=previous_stock)
+                item_stock[change.id] = change.stock_amount
+
+        # Only price changes affect derived costs; bundles first since recipe costs include them
+        repriced_ingredients = {c.id for c in batch.ingredients if c.price_per_ml is not None}
+        repriced_items = {c.id for c in batch.packaging_items if c.price is not None}
+        bundles_recomputed = costing.recompute_bundle_prices(db, repriced_items)
+        recipes_recomputed = costing.recompute_recipe_costs(db, repriced_ingredients, repriced_items)
+
+        return schemas.BatchPriceUpdateResult(
+            ingredients_updated=len(set(ingredient_ids)),
+            packaging_items_updated=len(set(item_ids)),
+            bundles_recomputed=bundles_recomputed,
+            recipes_recomputed=recipes_recomputed,
+        )
+
+    return run_write(db, mutation)
+
 # Package Bundle endpoints
-@app.post("/package-bundles/", response_model=schemas.PackageBundle)
-def create_package_bundle(bundle: schemas.PackageBundleCreate, db: Session = Depends(get_db)):
-    # Get all items for the bundle
-    items = db.query(models.PackagingItem).filter(models.PackagingItem.id.in_(bundle.item_ids)).all()
-    if len(items) != len(bundle.item_ids):
-        raise HTTPException(status_code=400, detail="Some packaging items not found")
-    
-    # Calculate total price
-    total_price = sum(item.price for item in items)
-    
-    # Create bundle
-    db_bundle = models.PackageBundle(
-        name=bundle.name,
-        description=bundle.description,
-        capacity=bundle.capacity,
-        notes=bundle.notes,
-        total_price=total_price,
-        items=items
-    )
-    
-    db.add(db_bundle)
-    db.commit()
-    db.refresh(db_bundle)
-    return db_bundle
+@router.post("/package-bundles/", response_model=schemas.PackageBundle)
+def create_package_bundle(bundle: schemas.PackageBundleCreate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        # Get all items for the bundle
+        items = db.query(models.PackagingItem).filter(models.PackagingItem.id.in_(bundle.item_ids)).all()
+        if len(items) != len(bundle.item_ids):
+            raise HTTPException(status_code=400, detail="Some packaging items not found")
+        
+        # Calculate total price
+        total_price = sum(item.price for item in items)
+        
+        # Create bundle
+        db_bundle = models.PackageBundle(
+            name=bundle.name,
+            description=bundle.description,
+            capacity=bundle.capacity,
+            notes=bundle.notes,
+            total_price=total_price,
+            items=items
+        )
+        
+        db.add(db_bundle)
+        db.flush()
+        db.refresh(db_bundle)
+        return schemas.PackageBundle.model_validate(db_bundle)
+
+    return run_write(db, mutation)
 
-@app.get("/package-bundles/", response_model=List[schemas.PackageBundle])
-def read_package_bundles(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/package-bundles/", response_model=List[schemas.PackageBundle], dependencies=LIST_GATE)
+def read_package_bundles(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
     bundles = db.query(models.PackageBundle).offset(skip).limit(limit).all()
     return bundles
 
-@app.get("/package-bundles/{bundle_id}", response_model=schemas.PackageBundle)
-def read_package_bundle(bundle_id: int, db: Session = Depends(get_db)):
+@router.get("/package-bundles/{bundle_id}", response_model=schemas.PackageBundle)
+def read_package_bundle(bundle_id: int, db: Session = Depends(get_tenant_db)):
     bundle = db.query(models.PackageBundle).filter(models.PackageBundle.id == bundle_id).first()
     if bundle is None:
         raise HTTPException(status_code=404, detail="Package bundle not found")
     return bundle
 
-@app.put("/package-bundles/{bundle_id}", response_model=schemas.PackageBundle)
-def update_package_bundle(bundle_id: int, bundle: schemas.PackageBundleCreate, db: Session = Depends(get_db)):
-    db_bundle = db.query(models.PackageBundle).filter(models.PackageBundle.id == bundle_id).first()
-    if db_bundle is None:
-        raise HTTPException(status_code=404, detail="Package bundle not found")
-    
-    # Get all items for the bundle
-    items = db.query(models.PackagingItem).filter(models.PackagingItem.id.in_(bundle.item_ids)).all()
-    if len(items) != len(bundle.item_ids):
-        raise HTTPException(status_code=400, detail="Some packaging items not found")
-    
-    # Update bundle
-    db_bundle.name = bundle.name
-    db_bundle.description = bundle.description
-    db_bundle.capacity = bundle.capacity
-    db_bundle.notes = bundle.notes
-    db_bundle.total_price = sum(item.price for item in items)
-    db_bundle.items = items
-    
-    db.commit()
-    db.refresh(db_bundle)
-    return db_bundle
+@router.put("/package-bundles/{bundle_id}", response_model=schemas.PackageBundle)
+def update_package_bundle(bundle_id: int, bundle: schemas.PackageBundleCreate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        db_bundle = db.query(models.PackageBundle).filter(models.PackageBundle.id == bundle_id).first()
+        if db_bundle is None:
+            raise HTTPException(status_code=404, detail="Package bundle not found")
+        
+        # Get all items for the bundle
+        items = db.query(models.PackagingItem).filter(models.PackagingItem.id.in_(bundle.item_ids)).all()
+        if len(items) != len(bundle.item_ids):
+            raise HTTPException(status_code=400, detail="Some packaging items not found")
+        
+        # Update bundle
+        db_bundle.name = bundle.name
+        db_bundle.description = bundle.description
+        db_bundle.capacity = bundle.capacity
+        db_bundle.notes = bundle.notes
+        db_bundle.total_price = sum(item.price for item in items)
+        db_bundle.items = items
+        db_bundle.updated_at = datetime.utcnow()
+        
+        db.flush()
+        db.refresh(db_bundle)
+        return schemas.PackageBundle.model_validate(db_bundle)
 
-@app.delete("/package-bundles/{bundle_id}")
-def delete_package_bundle(bundle_id: int, db: Session = Depends(get_db)):
-    bundle = db.query(models.PackageBundle).filter(models.PackageBundle.id == bundle_id).first()
-    if bundle is None:
-        raise HTTPException(status_code=404, detail="Package bundle not found")
-    
-    db.delete(bundle)
-    db.commit()
+    return run_write(db, mutation)
+
+@router.delete("/package-bundles/{bundle_id}")
+def delete_package_bundle(bundle_id: int, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        bundle = db.query(models.PackageBundle).filter(models.PackageBundle.id == bundle_id).first()
+        if bundle is None:
+            raise HTTPException(status_code=404, detail="Package bundle not found")
+        db.delete(bundle)
+
+    run_write(db, mutation)
     return {"message": "Package bundle deleted successfully"}
 
 # Recipe endpoints
-@app.post("/recipes/", response_model=schemas.Recipe)
-def create_recipe(recipe: schemas.RecipeCreate, db: Session = Depends(get_db)):
+def _convert_lines(db: Session, lines) -> List[measurement.Line]:
     try:
+        converted = measurement.convert_lines(db, lines)
+    except measurement.UnknownIngredient as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    # Check if we have enough stock
+    for line in converted:
+        ingredient = line.ingredient
+        if ingredient.stock_amount and ingredient.stock_amount < line.amount_ml:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Not enough stock for {ingredient.name}. "
+                       f"Need {line.amount_ml:g}ml but only have {ingredient.stock_amount}ml"
+            )
+    return converted
+
+@router.post("/recipes/", response_model=schemas.Recipe)
+def create_recipe(recipe: schemas.RecipeCreate, reject_near_duplicates: bool = False, db: Session = Depends(get_tenant_db)):
+    if reject_near_duplicates:
+        duplicates = [
+            match for match in _similar_recipes(db, recipe.ingredients, recipe.total_volume_ml, 5)
+            if match.similarity >= similarity.NEAR_DUPLICATE_THRESHOLD
+        ]
+        if duplicates:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Near-duplicate recipes exist", "matches": [match.dict() for match in duplicates]}
+            )
+
+    def mutation(db: Session):
         # Get package bundle
         package_bundle = db.query(models.PackageBundle).filter(models.PackageBundle.id == recipe.package_bundle_id).first()
         if not package_bundle:
             raise HTTPException(status_code=404, detail="Package bundle not found")
         
-        # Get all ingredients and calculate total cost
-        ingredients_cost = 0
-        recipe_ingredients = []
-        
-        for recipe_ingredient in recipe.ingredients:
-            ingredient = db.query(models.Ingredient).filter(models.Ingredient.id == recipe_ingredient.ingredient_id).first()
-            if not ingredient:
-                raise HTTPException(status_code=404, detail=f"Ingredient with id {recipe_ingredient.ingredient_id} not found")
-            
-            # Check if we have enough stock
-            if ingredient.stock_amount and ingredient.stock_amount < recipe_ingredient.amount_ml:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Not enough stock for {ingredient.name}. Need {recipe_ingredient.amount_ml}ml but only have {ingredient.stock_amount}ml"
-                )
-            
-            ingredients_cost += (ingredient.price_per_ml or 0) * recipe_ingredient.amount_ml
-            recipe_ingredients.append((ingredient, recipe_ingredient.amount_ml))
+        # Convert all lines to ml and cost them
+        recipe_ingredients = _convert_lines(db, recipe.ingredients)
         
         # Calculate total cost (ingredients + packaging)
-        total_cost = ingredients_cost + package_bundle.total_price
+        total_cost = sum(line.cost for line in recipe_ingredients) + package_bundle.total_price
         
         # Create recipe
         db_recipe = models.Recipe(
@@ -227,40 +492,118 @@ def create_recipe(recipe: schemas.RecipeCreate, db: Session = Depends(get_db)):
         )
         
         db.add(db_recipe)
-        db.commit()  # Commit to get recipe ID
+        db.flush()  # Flush to get recipe ID
         
         # Add recipe ingredients with amounts
-        for ingredient, amount_ml in recipe_ingredients:
-            recipe_ingredient = models.RecipeIngredient(
-                recipe_id=db_recipe.id,
-                ingredient_id=ingredient.id,
-                amount_ml=amount_ml
-            )
-            db.add(recipe_ingredient)
+        for line in recipe_ingredients:
+            db.add(measurement.recipe_ingredient(db_recipe.id, line))
         
-        db.commit()
+        db.flush()
         db.refresh(db_recipe)
-        return db_recipe
-        
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
+        return schemas.Recipe.model_validate(db_recipe)
+
+    return run_write(db, mutation)
 
-@app.get("/recipes/", response_model=List[schemas.Recipe])
-def read_recipes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/recipes/", response_model=List[schemas.Recipe], dependencies=RECIPE_LIST_GATE)
+def read_recipes(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
     recipes = db.query(models.Recipe).offset(skip).limit(limit).all()
     return recipes
 
-@app.get("/recipes/{recipe_id}", response_model=schemas.Recipe)
-def read_recipe(recipe_id: int, db: Session = Depends(get_db)):
+@router.get("/recipes/filter", response_model=schemas.RecipeFilterResult, dependencies=RECIPE_LIST_GATE)
+def filter_recipes(
+    properties: List[str] = Query([]),
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
+    # Recipes containing any ingredient with any of the given properties
+    names = _tag_names(properties)
+    query = db.query(models.Recipe.id)
+    if names:
+        recipe_ids = (
+            db.query(models.RecipeIngredient.recipe_id)
+            .filter(models.RecipeIngredient.ingredient_id.in_(tags.ingredients_with_tags(db, names, match_all=False)))
+            .scalar_subquery()
+        )
+        query = query.filter(models.Recipe.id.in_(recipe_ids))
+    ids = query.scalar_subquery()
+
+    items = (
+        db.query(models.Recipe)
+        .filter(models.Recipe.id.in_(ids))
+        .order_by(models.Recipe.id)
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    return schemas.RecipeFilterResult(
+        total=query.count(),
+        items=items,
+        facets={"properties": tags.recipe_tag_counts(db, ids)},
+    )
+
+def _similar_recipes(db: Session, ingredients, total_volume_ml: float, k: int, exclude: Optional[int] = None):
+    try:
+        lines = measurement.convert_lines(db, ingredients)
+    except measurement.UnknownIngredient as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    vector = similarity.recipe_vector([(line.ingredient.id, line.amount_ml) for line in lines], total_volume_ml)
+    return _similar_to_vector(db, vector, k, exclude)
+
+def _similar_to_vector(db: Session, vector: similarity.Vector, k: int, exclude: Optional[int] = None):
+    matches = similarity.similar_recipes(db, vector, k, exclude)
+    names = dict(
+        db.query(models.Recipe.id, models.Recipe.name).filter(models.Recipe.id.in_([recipe_id for recipe_id, _ in matches]))
+    )
+    return [
+        schemas.SimilarRecipe(recipe_id=recipe_id, name=names[recipe_id], similarity=score)
+        for recipe_id, score in matches if recipe_id in names
+    ]
+
+@router.post("/recipes/production-sheet", response_model=schemas.ProductionSheet, dependencies=REPORT_GATE)
+def production_sheet(request: schemas.ProductionSheetRequest, db: Session = Depends(get_tenant_db)):
+    # Every recipe (or the given ones) scaled to every size, with costs and stock checks.
+    # Serialized directly, as the sheet is already validated and can hold thousands of runs
+    sheet = production.production_sheet(db, request.recipe_ids, request.sizes)
+    return Response(content=sheet.model_dump_json(), media_type="application/json")
+
+@router.post("/recipes/similar", response_model=List[schemas.SimilarRecipe], dependencies=REPORT_GATE)
+def find_similar_recipes(
+    query: schemas.SimilarRecipeQuery,
+    k: int = Query(10, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
+    return _similar_recipes(db, query.ingredients, query.total_volume_ml, k)
+
+@router.get("/recipes/{recipe_id}/similar", response_model=List[schemas.SimilarRecipe], dependencies=REPORT_GATE)
+def read_similar_recipes(
+    recipe_id: int,
+    k: int = Query(10, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
+    recipe = db.query(models.Recipe).filter(models.Recipe.id == recipe_id).first()
+    if recipe is None:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    # Stored lines are already in ml, like the vectors in the index
+    vector = similarity.recipe_vector(
+        [(line.ingredient_id, line.amount_ml) for line in recipe.recipe_ingredients], recipe.total_volume_ml
+    )
+    return _similar_to_vector(db, vector, k, exclude=recipe_id)
+
+@router.get("/recipes/{recipe_id}", response_model=schemas.Recipe)
+def read_recipe(recipe_id: int, db: Session = Depends(get_tenant_db)):
     recipe = db.query(models.Recipe).filter(models.Recipe.id == recipe_id).first()
     if recipe is None:
         raise HTTPException(status_code=404, detail="Recipe not found")
     return recipe
 
-@app.put("/recipes/{recipe_id}", response_model=schemas.Recipe)
-def update_recipe(recipe_id: int, recipe: schemas.RecipeCreate, db: Session = Depends(get_db)):
-    try:
+@router.put("/recipes/{recipe_id}", response_model=schemas.Recipe)
+def update_recipe(recipe_id: int, recipe: schemas.RecipeCreate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
         db_recipe = db.query(models.Recipe).filter(models.Recipe.id == recipe_id).first()
         if db_recipe is None:
             raise HTTPException(status_code=404, detail="Recipe not found")
@@ -271,23 +614,8 @@ def update_recipe(recipe_id: int, recipe: schemas.RecipeCreate, db: Session = De
             raise HTTPException(status_code=404, detail="Package bundle not found")
         
         # Calculate new total cost
-        ingredients_cost = 0
-        recipe_ingredients = []
-        
-        for recipe_ingredient in recipe.ingredients:
-            ingredient = db.query(models.Ingredient).filter(models.Ingredient.id == recipe_ingredient.ingredient_id).first()
-            if not ingredient:
-                raise HTTPException(status_code=404, detail=f"Ingredient with id {recipe_ingredient.ingredient_id} not found")
-            
-            # Check if we have enough stock
-            if ingredient.stock_amount and ingredient.stock_amount < recipe_ingredient.amount_ml:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Not enough stock for {ingredient.name}. Need {recipe_ingredient.amount_ml}ml but only have {ingredient.stock_amount}ml"
-                )
-            
-            ingredients_cost += (ingredient.price_per_ml or 0) * recipe_ingredient.amount_ml
-            recipe_ingredients.append((ingredient, recipe_ingredient.amount_ml))
+        recipe_ingredients = _convert_lines(db, recipe.ingredients)
+        ingredients_cost = sum(line.cost for line in recipe_ingredients)
         
         # Update recipe
         db_recipe.name = recipe.name
@@ -297,34 +625,191 @@ def update_recipe(recipe_id: int, recipe: schemas.RecipeCreate, db: Session = De
         db_recipe.notes = recipe.notes
         db_recipe.total_cost = ingredients_cost + package_bundle.total_price
         db_recipe.package_bundle = package_bundle
+        db_recipe.updated_at = datetime.utcnow()
         
         # Update ingredients
         # First, remove all existing recipe ingredients
         db.query(models.RecipeIngredient).filter(models.RecipeIngredient.recipe_id == recipe_id).delete()
         
         # Add new recipe ingredients
-        for ingredient, amount_ml in recipe_ingredients:
-            recipe_ingredient = models.RecipeIngredient(
-                recipe_id=recipe_id,
-                ingredient_id=ingredient.id,
-                amount_ml=amount_ml
-            )
-            db.add(recipe_ingredient)
+        for line in recipe_ingredients:
+            db.add(measurement.recipe_ingredient(recipe_id, line))
         
-        db.commit()
+        db.flush()
         db.refresh(db_recipe)
-        return db_recipe
+        return schemas.Recipe.model_validate(db_recipe)
+
+    return run_write(db, mutation)
+
+@router.delete("/recipes/{recipe_id}")
+def delete_recipe(recipe_id: int, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        recipe = db.query(models.Recipe).filter(models.Recipe.id == recipe_id).first()
+        if recipe is None:
+            raise HTTPException(status_code=404, detail="Recipe not found")
+        db.delete(recipe)
+
+    run_write(db, mutation)
+    return {"message": "Recipe deleted successfully"}
+
+# Inventory endpoints
+def _get_stock_item(db: Session, item_kind: schemas.StockItemKind, item_id: int):
+    model = inventory.ITEM_MODELS[item_kind.value]
+    item = db.query(model).filter(model.id == item_id).first()
+    if item is None:
+        detail = "Ingredient not found" if item_kind == schemas.StockItemKind.INGREDIENT else "Packaging item not found"
+        raise HTTPException(status_code=404, detail=detail)
+    return item
+
+@router.post("/inventory/movements", response_model=schemas.StockMovement)
+def create_stock_movement(movement: schemas.StockMovementCreate, db: Session = Depends(get_tenant_db)):
+    def mutation(db: Session):
+        item = _get_stock_item(db, movement.item_kind, movement.item_id)
+        
+        if movement.kind == schemas.MovementKind.ADJUST:
+            if movement.quantity == 0:
+                raise HTTPException(status_code=400, detail="Adjustment must change the stock")
+            quantity = movement.quantity
+        else:
+            if movement.quantity <= 0:
+                raise HTTPException(status_code=400, detail="Quantity must be positive")
+            quantity = movement.quantity if movement.kind == schemas.MovementKind.RECEIVE else -movement.quantity
         
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
+        previous_stock = item.stock_amount or 0
+        # Like recipe creation, never take tracked stock below zero
+        if item.stock_amount is not None and quantity < 0 and previous_stock + quantity < 0:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Not enough stock: have {previous_stock:g} but {movement.kind.value} needs {-quantity:g}"
+            )
+        item.stock_amount = previous_stock + quantity
+        db_movement = inventory.record_movement(
+            db, movement.item_kind.value, movement.item_id, movement.kind.value, quantity,
+            previous_stock=previous_stock, notes=movement.notes
+        )
+        db.flush()
+        return schemas.StockMovement.model_validate(db_movement)
 
-@app.delete("/recipes/{recipe_id}")
-def delete_recipe(recipe_id: int, db: Session = Depends(get_db)):
-    recipe = db.query(models.Recipe).filter(models.Recipe.id == recipe_id).first()
-    if recipe is None:
-        raise HTTPException(status_code=404, detail="Recipe not found")
-    
-    db.delete(recipe)
-    db.commit()
-    return {"message": "Recipe deleted successfully"} 
\ No newline at end of file
+    return run_write(db, mutation)
+
+@router.get("/inventory/{item_kind}/{item_id}/movements", response_model=List[schemas.StockMovement], dependencies=LIST_GATE)
+def read_stock_movements(
+    item_kind: schemas.StockItemKind,
+    item_id: int,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
+    _get_stock_item(db, item_kind, item_id)
+    movements = db.query(models.StockMovement).filter(
+        models.StockMovement.item_kind == item_kind.value,
+        models.StockMovement.item_id == item_id
+    ).order_by(models.StockMovement.id.desc()).offset(skip).limit(limit).all()
+    return movements
+
+@router.get("/inventory/{item_kind}/{item_id}/stock", response_model=schemas.StockLevel)
+def read_stock_level(
+    item_kind: schemas.StockItemKind,
+    item_id: int,
+    at: Optional[datetime] = None,
+    db: Session = Depends(get_tenant_db)
+):
+    item = _get_stock_item(db, item_kind, item_id)
+    stock_amount = inventory.stock_at(db, item_kind.value, item_id, at)
+    # Items that were never moved have no ledger yet; their column is current
+    if stock_amount is None and at is None:
+        stock_amount = item.stock_amount
+    return schemas.StockLevel(item_kind=item_kind, item_id=item_id, at=at, stock_amount=stock_amount)
+
+@router.post("/inventory/snapshots")
+def compact_inventory(db: Session = Depends(get_tenant_db)):
+    snapshots = run_write(db, inventory.compact)
+    return {"snapshots_created": snapshots}
+
+# Report endpoints
+@router.get("/reports/recipe-margins", response_model=List[schemas.RecipeMargin], dependencies=REPORT_GATE)
+def read_recipe_margins(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
+    return reports.recipe_margins(db, skip, limit)
+
+@router.get("/reports/ingredient-cost-share", response_model=List[schemas.IngredientCostShare], dependencies=REPORT_GATE)
+def read_ingredient_cost_share(
+    limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE),
+    db: Session = Depends(get_tenant_db)
+):
+    return reports.ingredient_cost_share(db, limit)
+
+@router.get("/reports/packaging-cost-share", response_model=List[schemas.PackagingCostShare], dependencies=REPORT_GATE)
+def read_packaging_cost_share(limit: int = Query(100, ge=1, le=admission.MAX_PAGE_SIZE), db: Session = Depends(get_tenant_db)):
+    return reports.packaging_cost_share(db, limit)
+
+@router.get("/reports/ingredient-usage", response_model=List[schemas.IngredientUsage], dependencies=REPORT_GATE)
+def read_ingredient_usage(limit: int = Query(20, ge=1, le=admission.MAX_PAGE_SIZE), db: Session = Depends(get_tenant_db)):
+    return reports.ingredient_usage(db, limit)
+
+# Admin endpoints
+@router.post("/admin/backups", dependencies=ADMIN_GATE)
+def create_backup(db: Session = Depends(get_db)):
+    return backup.backup_to_file(db.get_bind(), backup.new_backup_path())
+
+@router.get("/admin/backup", dependencies=ADMIN_GATE)
+def download_backup(db: Session = Depends(get_db)):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    stats = backup.backup_to_file(db.get_bind(), path)
+    return FileResponse(
+        path,
+        filename=backup.backup_filename(),
+        media_type="application/vnd.sqlite3",
+        headers={"X-Backup-Pages": str(stats["pages"]), "X-Backup-Seconds": f"{stats['seconds']:.3f}"},
+        background=BackgroundTask(os.remove, path),
+    )
+
+# Metrics endpoints
+@router.get("/metrics")
+def read_metrics(request: Request):
+    return {
+        "latency": latency.summary(),
+        "write_queue": write_queue.metrics(),
+        "cache": cache.metrics(),
+        "admission": admission.metrics(request.app.state.gates),
+    }
+
+def create_app(storage: Storage = file_storage) -> FastAPI:
+    """Build an app instance serving the given storage; every instance has its own gates and overrides."""
+    app = FastAPI(title="AromaDB API")
+    app.include_router(router)
+    app.state.gates = admission.create_gates()
+    if storage is not file_storage:
+        app.dependency_overrides[get_db] = storage.get_db
+
+    # Retries carrying the same Idempotency-Key get the first response back.
+    # The middleware added last runs first, so CORS wraps the replays and rejections too
+    app.add_middleware(IdempotencyMiddleware)
+    app.middleware("http")(record_latency)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["*"],
+    )
+    app.add_exception_handler(IntegrityError, integrity_error)
+
+    @app.on_event("startup")
+    def check_schema():
+        # A single PRAGMA read; migrations run out of band (python migrations.py)
+        migrations.check(storage.engine)
+
+    @app.on_event("shutdown")
+    def stop_writers():
+        write_queue.stop_all(storage.engine)
+        similarity.drop_indexes(storage.engine)
+
+    return app
+
+app = create_app()
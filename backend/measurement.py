@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from sqlalchemy.orm import Session
+import models
+
+# Used when an ingredient measured in drops has no drops_per_ml of its own (0.05 ml per drop)
+DEFAULT_DROPS_PER_ML = 20.0
+
+
+class UnknownIngredient(LookupError):
+    def __init__(self, ingredient_id: int):
+        super().__init__(f"Ingredient with id {ingredient_id} not found")
+        self.ingredient_id = ingredient_id
+
+
+@dataclass
+class Line:
+    """A recipe line converted to canonical units: amount_ml and cost at the current price_per_ml."""
+    ingredient: models.Ingredient
+    amount: float
+    unit: str
+    amount_ml: float
+    cost: float
+
+
+def to_ml(amounts, units, drops_per_ml) -> np.ndarray:
+    """Convert amounts given in ml or drops to ml, element-wise."""
+    amounts = np.asarray(amounts, dtype=np.float64)
+    drops_per_ml = np.asarray(drops_per_ml, dtype=np.float64)
+    drops_per_ml = np.where(np.isnan(drops_per_ml) | (drops_per_ml <= 0), DEFAULT_DROPS_PER_ML, drops_per_ml)
+    return np.where(np.asarray(units) == "drops", amounts / drops_per_ml, amounts)
+
+
+def _amount_and_unit(line) -> tuple:
+    # Lines give either an explicit amount and unit, or the older amount_ml
+    amount = getattr(line, "amount", None)
+    if amount is None:
+        return line.amount_ml, "ml"
+    return amount, getattr(line.unit, "value", line.unit)
+
+
+def convert_recipes(db: Session, recipes: Sequence[Sequence]) -> List[List[Line]]:
+    """Convert the ingredient lines of many recipes at once.
+
+    Each line needs ingredient_id plus either amount and unit or amount_ml. All
+    ingredients are loaded with one query and every line is converted and costed
+    in a single vectorized pass; raises UnknownIngredient for a missing id.
+    """
+    flat = [line for lines in recipes for line in lines]
+    if not flat:
+        return [[] for _ in recipes]
+
+    ids = {line.ingredient_id for line in flat}
+    ingredients: Dict[int, models.Ingredient] = {
+        ingredient.id: ingredient
+        for ingredient in db.query(models.Ingredient).filter(models.Ingredient.id.in_(ids))
+    }
+    for line in flat:
+        if line.ingredient_id not in ingredients:
+            raise UnknownIngredient(line.ingredient_id)
+
+    amounts, units = zip(*(_amount_and_unit(line) for line in flat))
+    line_ingredients = [ingredients[line.ingredient_id] for line in flat]
+    drops_per_ml = [np.nan if i.drops_per_ml is None else i.drops_per_ml for i in line_ingredients]
+    prices = np.array([i.price_per_ml or 0.0 for i in line_ingredients], dtype=np.float64)
+
+    amounts_ml = to_ml(amounts, units, drops_per_ml)
+    costs = amounts_ml * prices
+
+    converted = [
+        Line(ingredient, float(amount), unit, float(amount_ml), float(cost))
+        for ingredient, amount, unit, amount_ml, cost in zip(line_ingredients, amounts, units, amounts_ml, costs)
+    ]
+    result, start = [], 0
+    for lines in recipes:
+        result.append(converted[start:start + len(lines)])
+        start += len(lines)
+    return result
+
+
+def convert_lines(db: Session, lines: Sequence) -> List[Line]:
+    return convert_recipes(db, [lines])[0]
+
+
+def recipe_ingredient(recipe_id: Optional[int], line: Line) -> models.RecipeIngredient:
+    return models.RecipeIngredient(
+        recipe_id=recipe_id,
+        ingredient_id=line.ingredient.id,
+        amount=line.amount,
+        unit=line.unit,
+        amount_ml=line.amount_ml,
+        cost=line.cost,
+    )
@@ -0,0 +1,44 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+MAX_SAMPLES = 10000
+
+
+class LatencyRecorder:
+    """Rolling window of recent request latencies."""
+
+    def __init__(self, max_samples: int = MAX_SAMPLES):
+        self._samples = deque(maxlen=max_samples)  # (finished_at, seconds)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds))
+
+    def percentile(self, q: float, since: Optional[float] = None, until: Optional[float] = None) -> Optional[float]:
+        """q-th percentile (0-100) in seconds of requests finished within [since, until], or None if there were none."""
+        with self._lock:
+            durations = sorted(
+                seconds for finished_at, seconds in self._samples
+                if (since is None or finished_at >= since) and (until is None or finished_at <= until)
+            )
+        if not durations:
+            return None
+        index = min(len(durations) - 1, int(round(q / 100 * (len(durations) - 1))))
+        return durations[index]
+
+    def summary(self):
+        return {
+            "samples": len(self._samples),
+            "p50_ms": to_ms(self.percentile(50)),
+            "p99_ms": to_ms(self.percentile(99)),
+        }
+
+
+def to_ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else seconds * 1000
+
+
+latency = LatencyRecorder()
@@ -0,0 +1,181 @@
+"""Versioned schema migrations.
+
+The schema version is kept in SQLite's PRAGMA user_version, so checking it
+costs a single header read. The API only checks the version on startup and
+refuses to start on a mismatch; migrations run out of band, before the
+workers start:
+
+    python migrations.py
+
+A new database is created at the latest version directly. Databases created
+before versioning (user_version 0) are brought up step by step; each step
+tolerates parts of it already being in place, since such databases may come
+from any earlier build.
+
+To change the schema, change models.py and append a step to MIGRATIONS.
+"""
+import sys
+from datetime import datetime
+from typing import List
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from database import Base, engine
+import models, tags
+
+TENANT_TABLES = ["ingredients", "packaging_items", "package_bundles", "recipes"]
+
+
+def _columns(conn: Connection, table: str) -> set:
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str):
+    if column not in _columns(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _create_tables(conn: Connection, *tables):
+    Base.metadata.create_all(conn, tables=list(tables), checkfirst=True)
+
+
+def _create_indexes(conn: Connection, table):
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _tenant_columns(conn: Connection):
+    # Existing rows belong to the default tenant; names become unique per tenant
+    now = datetime.utcnow().isoformat(" ")
+    for name in TENANT_TABLES:
+        _add_column(conn, name, "user_id", "VARCHAR NOT NULL DEFAULT 'default'")
+        if "updated_at" not in _columns(conn, name):
+            _add_column(conn, name, "updated_at", "DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00'")
+            conn.exec_driver_sql(f"UPDATE {name} SET updated_at = ?", (now,))
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS ix_{name}_name")
+        _create_indexes(conn, Base.metadata.tables[name])
+
+
+def _ledger_sync_and_cache_tables(conn: Connection):
+    _create_tables(
+        conn,
+        models.StockMovement.__table__,
+        models.StockSnapshot.__table__,
+        models.TableVersion.__table__,
+        models.SyncMapping.__table__,
+        models.SyncCheckpoint.__table__,
+    )
+    _create_indexes(conn, models.package_bundle_items)
+
+
+def _property_tags(conn: Connection):
+    _create_tables(conn, models.Tag.__table__, models.ingredient_tags)
+    _create_indexes(conn, models.Ingredient.__table__)
+    _create_indexes(conn, models.PackagingItem.__table__)
+
+    # Tag the existing ingredients, one tenant at a time so tags are not shared between tenants
+    db = Session(bind=conn)
+    try:
+        for user_id, in db.query(models.Ingredient.user_id).distinct().all():
+            db.info["user_id"] = user_id
+            for ingredient in db.query(models.Ingredient).all():
+                tags.sync_ingredient_tags(db, ingredient)
+            db.flush()
+    finally:
+        db.close()
+
+
+def _measurement_columns(conn: Connection):
+    # Existing lines were entered in ml; costs come from current prices
+    _add_column(conn, "recipe_ingredients", "amount", "FLOAT")
+    _add_column(conn, "recipe_ingredients", "unit", "VARCHAR NOT NULL DEFAULT 'ml'")
+    _add_column(conn, "recipe_ingredients", "cost", "FLOAT NOT NULL DEFAULT 0")
+    conn.exec_driver_sql("UPDATE recipe_ingredients SET amount = amount_ml WHERE amount IS NULL")
+    conn.exec_driver_sql(
+        "UPDATE recipe_ingredients SET cost = amount_ml * coalesce("
+        "(SELECT price_per_ml FROM ingredients WHERE ingredients.id = recipe_ingredients.ingredient_id), 0)"
+    )
+    # The covering index gained the cost column
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_recipe_ingredients_ingredient_id")
+    _create_indexes(conn, models.RecipeIngredient.__table__)
+
+
+def _idempotency_keys(conn: Connection):
+    _create_tables(conn, models.IdempotencyKey.__table__)
+
+
+def _sync_mapping_versions(conn: Connection):
+    # Unknown for existing mappings, so their rows are pushed once more
+    _add_column(conn, "sync_mappings", "synced_at", "DATETIME")
+
+
+def _idempotency_headers(conn: Connection):
+    # Responses stored before this are replayed with their content type only
+    _add_column(conn, "idempotency_keys", "headers", "TEXT")
+
+
+# (version, description, step); append only
+MIGRATIONS = [
+    (1, "tenant and timestamp columns", _tenant_columns),
+    (2, "stock ledger, sync and cache version tables", _ledger_sync_and_cache_tables),
+    (3, "ingredient property tags", _property_tags),
+    (4, "canonical recipe line amounts and costs", _measurement_columns),
+    (5, "idempotency keys", _idempotency_keys),
+    (6, "synced version of sync mappings", _sync_mapping_versions),
+    (7, "stored idempotent response headers", _idempotency_headers),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def _set_version(conn: Connection, version: int):
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def migrate(bind: Engine = engine) -> List[str]:
+    """Bring the database up to LATEST_VERSION; returns the descriptions of the steps applied."""
+    with bind.begin() as conn:
+        version = schema_version(conn)
+        if version == 0 and not inspect(conn).has_table("ingredients"):
+            Base.metadata.create_all(conn)
+            _set_version(conn, LATEST_VERSION)
+            return ["create schema"]
+    if version > LATEST_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this code ({LATEST_VERSION})")
+
+    applied = []
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        # One transaction per step, so a failed step leaves the database at the previous version
+        with bind.begin() as conn:
+            step(conn)
+            _set_version(conn, step_version)
+        applied.append(description)
+    return applied
+
+
+def check(bind: Engine = engine):
+    """Fail fast when the database is not at the version this code expects."""
+    with bind.connect() as conn:
+        version = schema_version(conn)
+    if version != LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}; run `python migrations.py` first"
+        )
+
+
+def main():
+    with engine.connect() as conn:
+        before = schema_version(conn)
+    applied = migrate(engine)
+    for description in applied:
+        print(f"Applied: {description}")
+    print(f"Schema version {before} -> {LATEST_VERSION}" if applied else f"Schema is up to date (version {LATEST_VERSION})")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
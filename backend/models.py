@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, Table, Index, DateTime, LargeBinary, UniqueConstraint
+from datetime import datetime, timedelta
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -7,24 +8,59 @@ package_bundle_items = Table(
     'package_bundle_items',
     Base.metadata,
     Column('bundle_id', Integer, ForeignKey('package_bundles.id'), primary_key=True),
-    Column('item_id', Integer, ForeignKey('packaging_items.id'), primary_key=True)
+    Column('item_id', Integer, ForeignKey('packaging_items.id'), primary_key=True),
+    Index('ix_package_bundle_items_item_id', 'item_id', 'bundle_id')
+)
+
+# Inverted index from therapeutic property tag to ingredients, see tags.py
+ingredient_tags = Table(
+    'ingredient_tags',
+    Base.metadata,
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
+    Column('ingredient_id', Integer, ForeignKey('ingredients.id'), primary_key=True),
+    Index('ix_ingredient_tags_ingredient_id', 'ingredient_id', 'tag_id')
 )
 
 class RecipeIngredient(Base):
     __tablename__ = 'recipe_ingredients'
+    __table_args__ = (
+        Index('ix_recipe_ingredients_ingredient_id', 'ingredient_id', 'recipe_id', 'amount_ml', 'cost'),
+    )
     
     recipe_id = Column(Integer, ForeignKey('recipes.id'), primary_key=True)
     ingredient_id = Column(Integer, ForeignKey('ingredients.id'), primary_key=True)
+    # Amount as entered, converted once to canonical ml, see measurement.py
+    amount = Column(Float, nullable=True)
+    unit = Column(String, nullable=False, default='ml')
     amount_ml = Column(Float, nullable=False)
+    cost = Column(Float, nullable=False, default=0.0)  # amount_ml * price_per_ml, kept current by costing.py
     
     # Relationship
     ingredient = relationship("Ingredient")
 
-class Ingredient(Base):
+class TenantMixin:
+    # Owner of the row (Firebase uid); every query is scoped to it, see tenancy.py
+    user_id = Column(String, nullable=False)
+
+# updated_at is stamped at flush, before commit; readers polling "changed since"
+# re-read this far back, in case a transaction committed well after it stamped rows
+UPDATED_AT_SLACK = timedelta(seconds=60)
+
+class TimestampMixin:
+    # Last local or synced change, used by firestore_sync.py to push only changed rows
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class Ingredient(TenantMixin, TimestampMixin, Base):
     __tablename__ = "ingredients"
+    __table_args__ = (
+        Index("ix_ingredients_user_id_name", "user_id", "name", unique=True),
+        Index("ix_ingredients_user_id_id", "user_id", "id"),
+        Index("ix_ingredients_user_id_updated_at", "user_id", "updated_at"),
+        Index("ix_ingredients_user_id_type", "user_id", "type"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True)
+    name = Column(String)
     type = Column(String)  # e.g., essential oil, carrier oil, hydrosol
     description = Column(Text)
     properties = Column(Text)  # therapeutic properties
@@ -35,12 +71,20 @@ class Ingredient(Base):
     drops_per_ml = Column(Float, nullable=True)  # conversion rate for drops
 
     recipe_ingredients = relationship("RecipeIngredient", back_populates="ingredient")
+    tags = relationship("Tag", secondary=ingredient_tags, back_populates="ingredients")
 
-class PackagingItem(Base):
+class PackagingItem(TenantMixin, TimestampMixin, Base):
     __tablename__ = "packaging_items"
+    __table_args__ = (
+        Index("ix_packaging_items_user_id_name", "user_id", "name", unique=True),
+        Index("ix_packaging_items_user_id_id", "user_id", "id"),
+        Index("ix_packaging_items_user_id_updated_at", "user_id", "updated_at"),
+        Index("ix_packaging_items_user_id_type", "user_id", "type"),
+        Index("ix_packaging_items_user_id_material", "user_id", "material"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True)
+    name = Column(String)
     type = Column(String)  # e.g., bottle, cap, label, box
     description = Column(Text)
     price = Column(Float)
@@ -53,11 +97,16 @@ class PackagingItem(Base):
     # Relationship with bundles
     bundles = relationship("PackageBundle", secondary=package_bundle_items, back_populates="items")
 
-class PackageBundle(Base):
+class PackageBundle(TenantMixin, TimestampMixin, Base):
     __tablename__ = "package_bundles"
+    __table_args__ = (
+        Index("ix_package_bundles_user_id_name", "user_id", "name", unique=True),
+        Index("ix_package_bundles_user_id_id", "user_id", "id"),
+        Index("ix_package_bundles_user_id_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True)
+    name = Column(String)
     description = Column(Text)
     total_price = Column(Float)  # Calculated from items
     capacity = Column(Float)  # in ml
@@ -69,11 +118,16 @@ class PackageBundle(Base):
     # Relationship with recipes
     recipes = relationship("Recipe", back_populates="package_bundle")
 
-class Recipe(Base):
+class Recipe(TenantMixin, TimestampMixin, Base):
     __tablename__ = "recipes"
+    __table_args__ = (
+        Index("ix_recipes_user_id_name", "user_id", "name", unique=True),
+        Index("ix_recipes_user_id_id", "user_id", "id"),
+        Index("ix_recipes_user_id_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, index=True)
+    name = Column(String)
     description = Column(Text)
     total_volume_ml = Column(Float)  # Total volume in milliliters
     retail_price = Column(Float, nullable=True)  # Suggested retail price
@@ -84,5 +138,92 @@ class Recipe(Base):
     package_bundle_id = Column(Integer, ForeignKey('package_bundles.id'))
     package_bundle = relationship("PackageBundle", back_populates="recipes")
     
-    # Relationship with ingredients through RecipeIngredient
-    recipe_ingredients = relationship("RecipeIngredient") 
\ No newline at end of file
+    # Relationship with ingredients through RecipeIngredient; lines go with their recipe
+    recipe_ingredients = relationship("RecipeIngredient", cascade="all, delete-orphan")
+
+class Tag(TenantMixin, Base):
+    __tablename__ = "tags"
+    __table_args__ = (
+        Index("ix_tags_user_id_name", "user_id", "name", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)  # normalized: lower case, trimmed
+
+    ingredients = relationship("Ingredient", secondary=ingredient_tags, back_populates="tags")
+
+class StockMovement(TenantMixin, Base):
+    __tablename__ = "stock_movements"
+    __table_args__ = (
+        Index("ix_stock_movements_item_id", "user_id", "item_kind", "item_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    item_kind = Column(String, nullable=False)  # 'ingredient' or 'packaging'
+    item_id = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)  # 'receive', 'consume' or 'adjust'
+    quantity = Column(Float, nullable=False)  # signed change in stock
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    notes = Column(Text, nullable=True)
+
+class StockSnapshot(TenantMixin, Base):
+    __tablename__ = "stock_snapshots"
+    __table_args__ = (
+        Index("ix_stock_snapshots_item_as_of", "user_id", "item_kind", "item_id", "as_of"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    item_kind = Column(String, nullable=False)
+    item_id = Column(Integer, nullable=False)
+    quantity = Column(Float, nullable=False)  # stock after applying every movement up to last_movement_id
+    last_movement_id = Column(Integer, nullable=False)
+    as_of = Column(DateTime, nullable=False)
+
+class TableVersion(Base):
+    # Bumped in the same transaction as every write to table_name, see cache.py
+    __tablename__ = "table_versions"
+
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class SyncMapping(TenantMixin, Base):
+    # Local row <-> Firestore document id, so repeated syncs update the same documents
+    __tablename__ = "sync_mappings"
+    __table_args__ = (
+        UniqueConstraint("user_id", "collection", "local_id"),
+        UniqueConstraint("collection", "remote_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    collection = Column(String, nullable=False)
+    local_id = Column(Integer, nullable=False)
+    remote_id = Column(String, nullable=False)
+    synced_at = Column(DateTime, nullable=True)  # updated_at of the version both sides hold
+
+class SyncCheckpoint(TenantMixin, Base):
+    __tablename__ = "sync_checkpoints"
+    __table_args__ = (
+        UniqueConstraint("user_id", "collection"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    collection = Column(String, nullable=False)
+    pushed_at = Column(DateTime, nullable=True)  # newest local updated_at already pushed
+    pulled_at = Column(DateTime, nullable=True)  # newest remote updatedAt already pulled
+
+class IdempotencyKey(Base):
+    # Responses stored for requests sent with an Idempotency-Key header, see idempotency.py
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("ix_idempotency_keys_created_at", "created_at"),
+        {"sqlite_with_rowid": False},
+    )
+
+    user_id = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)  # hash of method, path, query and body
+    status_code = Column(Integer, nullable=True)  # None while the first request is running
+    content_type = Column(String, nullable=True)
+    headers = Column(Text, nullable=True)  # JSON list of [name, value] pairs, e.g. Retry-After
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, nullable=False)
@@ -0,0 +1,200 @@
+import math
+from typing import List
+import numpy as np
+from sqlalchemy.orm import Session
+import models, schemas
+
+# Slack for float comparisons against stock and capacities
+EPSILON = 1e-9
+
+
+def _stock(value) -> float:
+    # Untracked stock never limits production
+    return math.inf if value is None else float(value)
+
+
+def _limit(value: float):
+    return None if math.isinf(value) else int(value)
+
+
+def production_sheet(db: Session, recipe_ids: List[int], sizes: List[schemas.ProductionSize]) -> schemas.ProductionSheet:
+    """Scale recipes to every requested size at once and cost and stock-check the result.
+
+    Each run is a recipe in one size: every line is scaled by volume_ml / total_volume_ml
+    and multiplied by the number of units, and packed in the bundle whose capacity fits
+    the size (the recipe's own bundle when its capacity matches, otherwise the smallest
+    bundle that holds the volume). All quantities are computed as lines x sizes arrays.
+    """
+    recipes = db.query(models.Recipe.id, models.Recipe.name, models.Recipe.total_volume_ml, models.Recipe.package_bundle_id)
+    lines = (
+        db.query(
+            models.RecipeIngredient.recipe_id, models.RecipeIngredient.ingredient_id, models.RecipeIngredient.amount,
+            models.RecipeIngredient.unit, models.RecipeIngredient.amount_ml, models.RecipeIngredient.cost,
+        )
+        .join(models.Recipe, models.Recipe.id == models.RecipeIngredient.recipe_id)
+    )
+    if recipe_ids:
+        recipes = recipes.filter(models.Recipe.id.in_(recipe_ids))
+        lines = lines.filter(models.Recipe.id.in_(recipe_ids))
+    recipes = recipes.order_by(models.Recipe.id).all()
+    if not recipes or not sizes:
+        return schemas.ProductionSheet(runs=[], requirements=[])
+    lines = lines.order_by(models.RecipeIngredient.recipe_id, models.RecipeIngredient.ingredient_id).all()
+
+    ingredients = (
+        db.query(models.Ingredient.id, models.Ingredient.name, models.Ingredient.stock_amount)
+        .filter(models.Ingredient.id.in_({line.ingredient_id for line in lines}))
+        .order_by(models.Ingredient.id)
+        .all()
+    )
+    bundles = db.query(
+        models.PackageBundle.id, models.PackageBundle.name, models.PackageBundle.capacity, models.PackageBundle.total_price
+    ).order_by(models.PackageBundle.capacity, models.PackageBundle.id).all()
+    bundle_items = (
+        db.query(
+            models.package_bundle_items.c.bundle_id,
+            models.PackagingItem.id,
+            models.PackagingItem.name,
+            models.PackagingItem.stock_amount,
+        )
+        .join(models.PackagingItem, models.PackagingItem.id == models.package_bundle_items.c.item_id)
+        .all()
+    )
+
+    # Sizes
+    volumes = np.array([size.volume_ml for size in sizes], dtype=np.float64)
+    units = np.array([size.units for size in sizes], dtype=np.float64)
+
+    # Lines
+    recipe_rows = {recipe.id: row for row, recipe in enumerate(recipes)}
+    ingredient_rows = {ingredient.id: row for row, ingredient in enumerate(ingredients)}
+    line_recipe = np.array([recipe_rows[line.recipe_id] for line in lines], dtype=np.int64)
+    line_ingredient = np.array([ingredient_rows[line.ingredient_id] for line in lines], dtype=np.int64)
+    line_amount = np.array([np.nan if line.amount is None else line.amount for line in lines], dtype=np.float64)
+    line_ml = np.array([line.amount_ml for line in lines], dtype=np.float64)
+    line_cost = np.array([line.cost or 0.0 for line in lines], dtype=np.float64)
+    stock = np.array([_stock(ingredient.stock_amount) for ingredient in ingredients], dtype=np.float64)
+
+    # Scale factors, recipes x sizes; recipes without a volume use the sum of their lines
+    line_volume = np.bincount(line_recipe, weights=line_ml, minlength=len(recipes))
+    recipe_volume = np.array([recipe.total_volume_ml or 0.0 for recipe in recipes], dtype=np.float64)
+    recipe_volume = np.where(recipe_volume > 0, recipe_volume, line_volume)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(recipe_volume[:, None] > 0, volumes[None, :] / recipe_volume[:, None], 0.0)
+
+    # Per line, lines x sizes
+    line_scale = scale[line_recipe]
+    unit_ml = line_ml[:, None] * line_scale
+    total_ml = unit_ml * units[None, :]
+    total_amount = line_amount[:, None] * line_scale * units[None, :]
+    total_cost = line_cost[:, None] * line_scale * units[None, :]
+    line_stock = stock[line_ingredient][:, None]
+    line_sufficient = total_ml <= line_stock + EPSILON
+    with np.errstate(divide="ignore", invalid="ignore"):
+        line_max = np.where(unit_ml > 0, np.floor(line_stock / unit_ml + EPSILON), np.inf)
+
+    # Per run, recipes x sizes
+    ingredients_cost = np.zeros((len(recipes), len(sizes)))
+    np.add.at(ingredients_cost, line_recipe, total_cost)
+    ingredient_max = np.full((len(recipes), len(sizes)), np.inf)
+    np.minimum.at(ingredient_max, line_recipe, line_max)
+
+    # Bundle per run: smallest capacity that holds the size, or the recipe's own when it matches exactly
+    bundle_rows = {bundle.id: row for row, bundle in enumerate(bundles)}
+    # Bundle arrays get a trailing entry for "no bundle", so that row -1 indexes it
+    capacities = np.array([np.nan if bundle.capacity is None else bundle.capacity for bundle in bundles] + [np.nan])
+    bundle_price = np.array([bundle.total_price or 0.0 for bundle in bundles] + [0.0])
+
+    sized = np.flatnonzero(~np.isnan(capacities))  # bundles are ordered by capacity
+    size_bundle = np.full(len(sizes), -1, dtype=np.int64)
+    if len(sized):
+        fitting = np.searchsorted(capacities[sized], volumes - EPSILON)
+        fits = fitting < len(sized)
+        size_bundle[fits] = sized[fitting[fits]]
+    own_bundle = np.array([bundle_rows.get(recipe.package_bundle_id, -1) for recipe in recipes], dtype=np.int64)
+    own_fits = np.isclose(capacities[own_bundle][:, None], volumes[None, :])
+    run_bundle = np.where(own_fits, own_bundle[:, None], size_bundle[None, :])
+    packaging_cost = bundle_price[run_bundle] * units[None, :]
+
+    item_rows = {}
+    pairs = []
+    for bundle_id, item_id, name, item_stock in bundle_items:
+        if bundle_id in bundle_rows:
+            row = item_rows.setdefault(item_id, (len(item_rows), name, _stock(item_stock)))[0]
+            pairs.append((bundle_rows[bundle_id], row))
+    item_stock = np.array([item[2] for item in item_rows.values()], dtype=np.float64)
+    bundle_max = np.full(len(bundles) + 1, np.inf)
+    if pairs:
+        pair_bundle, pair_item = (np.array(column, dtype=np.int64) for column in zip(*pairs))
+        np.minimum.at(bundle_max, pair_bundle, np.floor(item_stock[pair_item] + EPSILON))
+    max_units = np.minimum(ingredient_max, bundle_max[run_bundle])
+    sufficient = units[None, :] <= max_units
+
+    # Totals over the whole sheet
+    ingredient_required = np.bincount(line_ingredient, weights=total_ml.sum(axis=1), minlength=len(ingredients))
+    bundle_units = np.bincount(run_bundle[run_bundle >= 0], weights=np.broadcast_to(units, run_bundle.shape)[run_bundle >= 0],
+                               minlength=len(bundles))
+    item_required = np.zeros(len(item_rows))
+    if pairs:
+        np.add.at(item_required, pair_item, bundle_units[pair_bundle])
+
+    requirements = [
+        schemas.ProductionRequirement(
+            item_kind="ingredient", item_id=ingredient.id, name=ingredient.name, required=required,
+            stock=ingredient.stock_amount, shortfall=max(0.0, required - _stock(ingredient.stock_amount)),
+        )
+        for ingredient, required in zip(ingredients, ingredient_required.tolist())
+    ] + [
+        schemas.ProductionRequirement(
+            item_kind="packaging", item_id=item_id, name=name, required=required,
+            stock=None if math.isinf(stock_left) else stock_left, shortfall=max(0.0, required - stock_left),
+        )
+        for (item_id, (_, name, stock_left)), required in zip(item_rows.items(), item_required.tolist())
+        if required
+    ]
+
+    # Rows as plain dicts, validated in one pass at the end; lines are grouped by recipe,
+    # so each recipe's lines are a slice
+    starts = np.searchsorted(line_recipe, np.arange(len(recipes) + 1)).tolist()
+    line_ids = [line.ingredient_id for line in lines]
+    line_units = [schemas.MeasurementType(line.unit or "ml") for line in lines]
+    names = [ingredient.name for ingredient in ingredients]
+    line_names = [names[row] for row in line_ingredient.tolist()]
+    total_amount = np.where(np.isnan(total_amount), None, total_amount).tolist()
+    total_ml, total_cost, line_sufficient = total_ml.tolist(), total_cost.tolist(), line_sufficient.tolist()
+    scale, ingredients_cost, packaging_cost = scale.tolist(), ingredients_cost.tolist(), packaging_cost.tolist()
+    run_bundle, max_units, sufficient = run_bundle.tolist(), max_units.tolist(), sufficient.tolist()
+
+    runs = []
+    for row, recipe in enumerate(recipes):
+        for column, size in enumerate(sizes):
+            bundle = bundles[run_bundle[row][column]] if run_bundle[row][column] >= 0 else None
+            cost = ingredients_cost[row][column] + packaging_cost[row][column]
+            runs.append(dict(
+                recipe_id=recipe.id,
+                name=recipe.name,
+                volume_ml=size.volume_ml,
+                units=size.units,
+                scale=scale[row][column],
+                package_bundle_id=bundle.id if bundle else None,
+                package_bundle_name=bundle.name if bundle else None,
+                ingredients_cost=ingredients_cost[row][column],
+                packaging_cost=packaging_cost[row][column],
+                total_cost=cost,
+                unit_cost=cost / size.units,
+                max_units=_limit(max_units[row][column]),
+                sufficient=sufficient[row][column],
+                lines=[
+                    dict(
+                        ingredient_id=line_ids[i],
+                        name=line_names[i],
+                        amount=total_amount[i][column],
+                        unit=line_units[i],
+                        amount_ml=total_ml[i][column],
+                        cost=total_cost[i][column],
+                        sufficient=line_sufficient[i][column],
+                    )
+                    for i in range(starts[row], starts[row + 1])
+                ],
+            ))
+    return schemas.ProductionSheet.model_validate({"runs": runs, "requirements": requirements})
@@ -0,0 +1,121 @@
+from typing import List
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from cache import cache
+import models, schemas
+
+RECIPE_TABLES = ("recipes", "recipe_ingredients", "ingredients", "package_bundles")
+PACKAGING_TABLES = ("recipes", "package_bundles", "package_bundle_items", "packaging_items")
+
+
+def _cached(db: Session, name: str, tables, compute, *params):
+    key = (db.get_bind().url, db.info.get("user_id"), name) + params
+    return cache.get_or_compute(db, key, tables, compute)
+
+
+def recipe_margins(db: Session, skip: int = 0, limit: int = 100) -> List[schemas.RecipeMargin]:
+    """Cost and margin per recipe from stored line costs and current packaging prices."""
+    def compute():
+        ingredients_cost = (
+            db.query(
+                models.RecipeIngredient.recipe_id.label("recipe_id"),
+                func.sum(models.RecipeIngredient.cost).label("cost"),
+            )
+            .group_by(models.RecipeIngredient.recipe_id)
+            .subquery()
+        )
+        ingredients_total = func.coalesce(ingredients_cost.c.cost, 0)
+        packaging_total = func.coalesce(models.PackageBundle.total_price, 0)
+        total_cost = ingredients_total + packaging_total
+        margin = models.Recipe.retail_price - total_cost
+
+        rows = (
+            db.query(
+                models.Recipe.id, models.Recipe.name, models.Recipe.retail_price,
+                ingredients_total, packaging_total, total_cost, margin,
+            )
+            .outerjoin(ingredients_cost, ingredients_cost.c.recipe_id == models.Recipe.id)
+            .outerjoin(models.PackageBundle, models.PackageBundle.id == models.Recipe.package_bundle_id)
+            .order_by(margin.desc(), models.Recipe.id)
+            .offset(skip).limit(limit)
+            .all()
+        )
+        return [
+            schemas.RecipeMargin(
+                recipe_id=row[0], name=row[1], retail_price=row[2],
+                ingredients_cost=row[3], packaging_cost=row[4], total_cost=row[5], margin=row[6],
+                margin_pct=row[6] / row[2] if row[2] else None,
+            )
+            for row in rows
+        ]
+
+    return _cached(db, "recipe_margins", RECIPE_TABLES, compute, skip, limit)
+
+
+def ingredient_cost_share(db: Session, limit: int = 100) -> List[schemas.IngredientCostShare]:
+    """Share of the catalog's total ingredient cost attributable to each ingredient."""
+    def compute():
+        cost = func.sum(models.RecipeIngredient.cost)
+        rows = (
+            db.query(models.Ingredient.id, models.Ingredient.name, cost, cost / func.sum(cost).over())
+            .join(models.RecipeIngredient, models.RecipeIngredient.ingredient_id == models.Ingredient.id)
+            .join(models.Recipe, models.Recipe.id == models.RecipeIngredient.recipe_id)
+            .group_by(models.Ingredient.id)
+            .order_by(cost.desc(), models.Ingredient.id)
+            .limit(limit)
+            .all()
+        )
+        return [
+            schemas.IngredientCostShare(ingredient_id=row[0], name=row[1], total_cost=row[2], share=row[3] or 0)
+            for row in rows
+        ]
+
+    return _cached(db, "ingredient_cost_share", RECIPE_TABLES, compute, limit)
+
+
+def packaging_cost_share(db: Session, limit: int = 100) -> List[schemas.PackagingCostShare]:
+    """Share of the catalog's total packaging cost attributable to each packaging item."""
+    def compute():
+        cost = func.sum(func.coalesce(models.PackagingItem.price, 0))
+        rows = (
+            db.query(
+                models.PackagingItem.id, models.PackagingItem.name,
+                func.count(models.Recipe.id), cost, cost / func.sum(cost).over(),
+            )
+            .join(models.package_bundle_items, models.package_bundle_items.c.item_id == models.PackagingItem.id)
+            .join(models.PackageBundle, models.PackageBundle.id == models.package_bundle_items.c.bundle_id)
+            .join(models.Recipe, models.Recipe.package_bundle_id == models.PackageBundle.id)
+            .group_by(models.PackagingItem.id)
+            .order_by(cost.desc(), models.PackagingItem.id)
+            .limit(limit)
+            .all()
+        )
+        return [
+            schemas.PackagingCostShare(
+                item_id=row[0], name=row[1], recipe_count=row[2], total_cost=row[3], share=row[4] or 0
+            )
+            for row in rows
+        ]
+
+    return _cached(db, "packaging_cost_share", PACKAGING_TABLES, compute, limit)
+
+
+def ingredient_usage(db: Session, limit: int = 20) -> List[schemas.IngredientUsage]:
+    """Ingredients ranked by total volume used across all recipes."""
+    def compute():
+        volume = func.sum(models.RecipeIngredient.amount_ml)
+        rows = (
+            db.query(models.Ingredient.id, models.Ingredient.name, volume, func.count(models.RecipeIngredient.recipe_id))
+            .join(models.RecipeIngredient, models.RecipeIngredient.ingredient_id == models.Ingredient.id)
+            .join(models.Recipe, models.Recipe.id == models.RecipeIngredient.recipe_id)
+            .group_by(models.Ingredient.id)
+            .order_by(volume.desc(), models.Ingredient.id)
+            .limit(limit)
+            .all()
+        )
+        return [
+            schemas.IngredientUsage(ingredient_id=row[0], name=row[1], total_ml=row[2], recipe_count=row[3])
+            for row in rows
+        ]
+
+    return _cached(db, "ingredient_usage", RECIPE_TABLES, compute, limit)
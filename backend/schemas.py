@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional, List, Dict
+from datetime import datetime
 from enum import Enum
 
 class MeasurementType(str, Enum):
@@ -65,14 +66,28 @@ class PackageBundle(PackageBundleBase):
 
 class RecipeIngredientBase(BaseModel):
     ingredient_id: int
-    amount_ml: float
+    # Either amount_ml, or amount in unit (drops are converted with the ingredient's drops_per_ml)
+    amount_ml: Optional[float] = None
+    amount: Optional[float] = None
+    unit: MeasurementType = MeasurementType.ML
+
+    @model_validator(mode="after")
+    def check_amount(self):
+        if (self.amount is None) == (self.amount_ml is None):
+            raise ValueError("Give either amount_ml or amount with unit")
+        if self.amount_ml is not None and self.unit != MeasurementType.ML:
+            raise ValueError("amount_ml is always in ml; give amount with unit for other units")
+        return self
 
 class RecipeIngredientCreate(RecipeIngredientBase):
     pass
 
 class RecipeIngredientDetail(BaseModel):
     ingredient: Ingredient
+    amount: Optional[float] = None
+    unit: MeasurementType = MeasurementType.ML
     amount_ml: float
+    cost: float = 0.0
 
     class Config:
         from_attributes = True
@@ -95,4 +110,156 @@ class Recipe(RecipeBase):
     total_cost: float
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+
+class IngredientPriceUpdate(BaseModel):
+    id: int
+    price_per_ml: Optional[float] = None
+    stock_amount: Optional[float] = None
+
+class PackagingItemPriceUpdate(BaseModel):
+    id: int
+    price: Optional[float] = None
+    stock_amount: Optional[int] = None
+
+class BatchPriceUpdate(BaseModel):
+    ingredients: List[IngredientPriceUpdate] = []
+    packaging_items: List[PackagingItemPriceUpdate] = []
+
+class BatchPriceUpdateResult(BaseModel):
+    ingredients_updated: int
+    packaging_items_updated: int
+    bundles_recomputed: int
+    recipes_recomputed: int
+
+class StockItemKind(str, Enum):
+    INGREDIENT = "ingredient"
+    PACKAGING = "packaging"
+
+class MovementKind(str, Enum):
+    RECEIVE = "receive"
+    CONSUME = "consume"
+    ADJUST = "adjust"
+
+class StockMovementCreate(BaseModel):
+    item_kind: StockItemKind
+    item_id: int
+    kind: MovementKind
+    quantity: float  # amount received/consumed, or signed change for adjustments
+    notes: Optional[str] = None
+
+class StockMovement(BaseModel):
+    id: int
+    item_kind: StockItemKind
+    item_id: int
+    kind: MovementKind
+    quantity: float  # signed change in stock
+    created_at: datetime
+    notes: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class StockLevel(BaseModel):
+    item_kind: StockItemKind
+    item_id: int
+    at: Optional[datetime] = None
+    stock_amount: Optional[float] = None  # None when there is no history for that time
+
+class RecipeMargin(BaseModel):
+    recipe_id: int
+    name: str
+    retail_price: Optional[float] = None
+    ingredients_cost: float
+    packaging_cost: float
+    total_cost: float
+    margin: Optional[float] = None
+    margin_pct: Optional[float] = None
+
+class IngredientCostShare(BaseModel):
+    ingredient_id: int
+    name: str
+    total_cost: float
+    share: float  # fraction of the catalog's total ingredient cost
+
+class PackagingCostShare(BaseModel):
+    item_id: int
+    name: str
+    recipe_count: int
+    total_cost: float
+    share: float  # fraction of the catalog's total packaging cost
+
+class IngredientUsage(BaseModel):
+    ingredient_id: int
+    name: str
+    total_ml: float
+    recipe_count: int
+
+class SimilarRecipe(BaseModel):
+    recipe_id: int
+    name: str
+    similarity: float  # cosine similarity of ingredient proportions, 0..1
+
+class SimilarRecipeQuery(BaseModel):
+    total_volume_ml: float
+    ingredients: List[RecipeIngredientBase]
+
+class IngredientFilterResult(BaseModel):
+    total: int
+    items: List[Ingredient]
+    facets: Dict[str, Dict[str, int]]  # facet name -> value -> count among all matches
+
+class PackagingItemFilterResult(BaseModel):
+    total: int
+    items: List[PackagingItem]
+    facets: Dict[str, Dict[str, int]]
+
+class RecipeFilterResult(BaseModel):
+    total: int
+    items: List[Recipe]
+    facets: Dict[str, Dict[str, int]]
+
+class ProductionSize(BaseModel):
+    volume_ml: float = Field(gt=0)
+    units: int = Field(1, ge=1)
+
+class ProductionSheetRequest(BaseModel):
+    recipe_ids: List[int] = []  # empty for every recipe
+    sizes: List[ProductionSize]
+
+class ProductionLine(BaseModel):
+    ingredient_id: int
+    name: str
+    amount: Optional[float] = None  # in unit, as entered on the recipe
+    unit: MeasurementType = MeasurementType.ML
+    amount_ml: float
+    cost: float
+    sufficient: bool
+
+class ProductionRun(BaseModel):
+    recipe_id: int
+    name: str
+    volume_ml: float
+    units: int
+    scale: float
+    package_bundle_id: Optional[int] = None
+    package_bundle_name: Optional[str] = None
+    ingredients_cost: float
+    packaging_cost: float
+    total_cost: float
+    unit_cost: float
+    max_units: Optional[int] = None  # producible from current stock, None if nothing is tracked
+    sufficient: bool
+    lines: List[ProductionLine]
+
+class ProductionRequirement(BaseModel):
+    item_kind: StockItemKind
+    item_id: int
+    name: str
+    required: float
+    stock: Optional[float] = None
+    shortfall: float
+
+class ProductionSheet(BaseModel):
+    runs: List[ProductionRun]
+    requirements: List[ProductionRequirement]  # totals if every run is produced
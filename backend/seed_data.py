@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
-import models
+import migrations, models, tags
+from storage import Storage, file_storage
+from tenancy import DEFAULT_TENANT
 
 # Create mock ingredients data
 mock_ingredients = [
@@ -186,11 +187,12 @@ mock_recipes = [
     }
 ]
 
-def seed_database():
-    # Create tables
-    models.Base.metadata.create_all(bind=engine)
+def seed_database(storage: Storage = file_storage):
+    # Create or upgrade the schema
+    migrations.migrate(storage.engine)
     
-    db = SessionLocal()
+    db = storage.SessionLocal()
+    db.info["user_id"] = DEFAULT_TENANT
     try:
         # Check if we already have data for any of our entities
         has_ingredients = db.query(models.Ingredient).count() > 0
@@ -203,6 +205,8 @@ def seed_database():
             for ingredient_data in mock_ingredients:
                 ingredient = models.Ingredient(**ingredient_data)
                 db.add(ingredient)
+                tags.sync_ingredient_tags(db, ingredient)
+                db.flush()
             db.commit()
             
             # Add packaging items
@@ -257,7 +261,10 @@ def seed_database():
                     recipe_ingredient = models.RecipeIngredient(
                         recipe_id=recipe.id,
                         ingredient_id=ingredients_dict[ing_data["name"]].id,
-                        amount_ml=ing_data["amount_ml"]
+                        amount=ing_data["amount_ml"],
+                        unit="ml",
+                        amount_ml=ing_data["amount_ml"],
+                        cost=ingredients_dict[ing_data["name"]].price_per_ml * ing_data["amount_ml"]
                     )
                     db.add(recipe_ingredient)
             
@@ -0,0 +1,189 @@
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from cache import table_versions
+import models
+
+# Recipes at or above this cosine similarity count as near-duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.98
+
+Vector = Dict[int, float]
+
+
+def recipe_vector(lines: Iterable[Tuple[int, float]], total_volume_ml: Optional[float]) -> Vector:
+    """Sparse ingredient-proportion vector: ingredient_id -> amount_ml / total_volume_ml."""
+    vector = {}
+    for ingredient_id, amount_ml in lines:
+        vector[ingredient_id] = vector.get(ingredient_id, 0.0) + (amount_ml or 0.0)
+    volume = total_volume_ml or sum(vector.values()) or 1.0
+    return {ingredient_id: amount / volume for ingredient_id, amount in vector.items() if amount}
+
+
+class SimilarityIndex:
+    """Cosine-similarity index over sparse recipe vectors.
+
+    Vectors are kept in per-ingredient posting lists with precomputed row norms,
+    so a query only touches the recipes sharing at least one ingredient with it.
+    """
+
+    def __init__(self):
+        self._rows: Dict[int, int] = {}  # recipe_id -> row
+        self._row_ids = np.zeros(0, dtype=np.int64)  # row -> recipe_id, -1 if free
+        self._norms = np.zeros(0)
+        self._vectors: Dict[int, Vector] = {}
+        self._free: List[int] = []
+        self._known = set()  # every indexed recipe, including ones without ingredients
+        self._postings: Dict[int, Dict[int, float]] = {}  # ingredient_id -> {row: weight}
+        self._arrays: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}  # posting lists as arrays, built lazily
+        self.lock = threading.Lock()
+        self.versions = None
+        self.watermark: Optional[datetime] = None
+
+    def __len__(self):
+        return len(self._known)
+
+    def recipe_ids(self):
+        return list(self._known)
+
+    def upsert(self, recipe_id: int, vector: Vector):
+        self.remove(recipe_id)
+        self._known.add(recipe_id)
+        if not vector:
+            return
+        row = self._free.pop() if self._free else len(self._rows)
+        if row >= len(self._norms):
+            capacity = max(1024, 2 * len(self._norms))
+            self._norms = np.concatenate([self._norms, np.zeros(capacity - len(self._norms))])
+            self._row_ids = np.concatenate([self._row_ids, np.full(capacity - len(self._row_ids), -1, dtype=np.int64)])
+        self._rows[recipe_id] = row
+        self._row_ids[row] = recipe_id
+        self._norms[row] = np.sqrt(sum(weight * weight for weight in vector.values()))
+        self._vectors[recipe_id] = vector
+        for ingredient_id, weight in vector.items():
+            self._postings.setdefault(ingredient_id, {})[row] = weight
+            self._arrays.pop(ingredient_id, None)
+
+    def remove(self, recipe_id: int):
+        self._known.discard(recipe_id)
+        row = self._rows.pop(recipe_id, None)
+        if row is None:
+            return
+        for ingredient_id in self._vectors.pop(recipe_id):
+            posting = self._postings[ingredient_id]
+            del posting[row]
+            if not posting:
+                del self._postings[ingredient_id]
+            self._arrays.pop(ingredient_id, None)
+        self._row_ids[row] = -1
+        self._norms[row] = 0.0
+        self._free.append(row)
+
+    def _posting_arrays(self, ingredient_id: int):
+        arrays = self._arrays.get(ingredient_id)
+        if arrays is None:
+            posting = self._postings[ingredient_id]
+            arrays = (
+                np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                np.fromiter(posting.values(), dtype=np.float64, count=len(posting)),
+            )
+            self._arrays[ingredient_id] = arrays
+        return arrays
+
+    def query(self, vector: Vector, k: int = 10, exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top-k (recipe_id, cosine similarity) for a vector, best first."""
+        query_norm = np.sqrt(sum(weight * weight for weight in vector.values()))
+        if k < 1 or not query_norm or not self._rows:
+            return []
+
+        scores = np.zeros(len(self._norms))
+        for ingredient_id, weight in vector.items():
+            if ingredient_id in self._postings:
+                rows, weights = self._posting_arrays(ingredient_id)
+                scores[rows] += weight * weights
+
+        candidates = np.flatnonzero(scores)
+        if exclude is not None and exclude in self._rows:
+            candidates = candidates[candidates != self._rows[exclude]]
+        if not len(candidates):
+            return []
+        similarities = scores[candidates] / (self._norms[candidates] * query_norm)
+
+        if len(candidates) > k:
+            top = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return [(int(self._row_ids[candidates[i]]), float(similarities[i])) for i in top]
+
+
+_indexes: Dict[tuple, SimilarityIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _load_vectors(db: Session, since: Optional[datetime] = None) -> Dict[int, Vector]:
+    recipes = db.query(models.Recipe.id, models.Recipe.total_volume_ml)
+    if since is not None:
+        recipes = recipes.filter(models.Recipe.updated_at >= since)
+    volumes = dict(recipes)
+    if not volumes:
+        return {}
+
+    lines = db.query(
+        models.RecipeIngredient.recipe_id, models.RecipeIngredient.ingredient_id, models.RecipeIngredient.amount_ml
+    )
+    if since is not None:
+        lines = lines.filter(models.RecipeIngredient.recipe_id.in_(volumes.keys()))
+    else:
+        lines = lines.join(models.Recipe, models.Recipe.id == models.RecipeIngredient.recipe_id)
+    grouped: Dict[int, list] = {recipe_id: [] for recipe_id in volumes}
+    for recipe_id, ingredient_id, amount_ml in lines:
+        grouped[recipe_id].append((ingredient_id, amount_ml))
+    return {recipe_id: recipe_vector(grouped[recipe_id], volumes[recipe_id]) for recipe_id in volumes}
+
+
+def drop_indexes(bind: Engine):
+    """Forget the indexes built over a database, e.g. when it goes away."""
+    with _indexes_lock:
+        for key in [key for key in _indexes if key[0] == bind.url]:
+            del _indexes[key]
+
+
+def get_index(db: Session) -> SimilarityIndex:
+    """The tenant's index, brought up to date with any writes from this or other workers."""
+    key = (db.get_bind().url, db.info.get("user_id"))
+    with _indexes_lock:
+        index = _indexes.setdefault(key, SimilarityIndex())
+
+    versions = table_versions(db)
+    current = (versions.get("recipes", 0), versions.get("recipe_ingredients", 0))
+    with index.lock:
+        if index.versions == current:
+            return index
+
+        started = datetime.utcnow()
+        since = index.watermark - models.UPDATED_AT_SLACK if index.watermark is not None else None
+        changed = _load_vectors(db, since)
+        for recipe_id, vector in changed.items():
+            index.upsert(recipe_id, vector)
+
+        # Only scan ids when the counts show that something was deleted
+        if since is not None:
+            count = db.query(func.count(models.Recipe.id)).scalar()
+            if count != len(index):
+                existing = {recipe_id for recipe_id, in db.query(models.Recipe.id)}
+                for recipe_id in [r for r in index.recipe_ids() if r not in existing]:
+                    index.remove(recipe_id)
+
+        index.watermark = started
+        index.versions = current
+        return index
+
+
+def similar_recipes(db: Session, vector: Vector, k: int = 10, exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+    index = get_index(db)
+    with index.lock:
+        return index.query(vector, k, exclude)
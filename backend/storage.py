@@ -0,0 +1,112 @@
+"""Storage backends the API can run on.
+
+The endpoints get their sessions from database.get_db. An app created with
+main.create_app(storage) overrides get_db with storage.get_db, so every
+endpoint, the idempotency middleware and the group-commit writer run on that
+storage. Two backends exist:
+
+- file_storage, the SQLite file next to this module (the default)
+- MemoryStorage, a private throwaway database on tmpfs for tests and benchmarks
+
+Both are WAL-mode SQLite files, so queries, constraints, locking and
+migrations behave the same on either.
+
+    template = memory_storage()
+    seed_data.seed_database(template)                         # once
+    app = main.create_app(memory_storage(template))           # per test module or worker
+    app.dependency_overrides[get_db] = memory_storage(template).get_db   # per test
+
+Copying a small database takes under a millisecond; building an app takes
+tens, almost all of it FastAPI analysing the routes.
+"""
+import atexit
+import os
+import tempfile
+import threading
+from typing import Optional
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+from database import SessionLocal, configure_engine, engine
+import migrations, similarity, write_queue
+
+
+class Storage:
+    def __init__(self, engine: Engine, session_factory: Optional[sessionmaker] = None):
+        self.engine = engine
+        self.SessionLocal = session_factory or sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_db(self):
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def dispose(self):
+        # Background state kept per database
+        write_queue.stop_all(self.engine)
+        similarity.drop_indexes(self.engine)
+        self.engine.dispose()
+
+
+# tmpfs, where available, so a private database never touches the disk
+TEMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class MemoryStorage(Storage):
+    """A private SQLite database in a temporary file, on tmpfs where available.
+
+    It is an ordinary WAL database, so sessions lock, wait and see each
+    other's commits exactly as on aromatherapy.db; only the file differs.
+    Separate instances never see each other's data. dispose() deletes it.
+    """
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix="aromadb-", suffix=".db", dir=TEMP_DIR)
+        os.close(fd)
+        super().__init__(configure_engine(create_engine(
+            f"sqlite:///{self.path}", connect_args={"check_same_thread": False}
+        )))
+
+    def copy_to(self, other: "MemoryStorage"):
+        """Overwrite other with a page-by-page copy of this database."""
+        source = self.engine.raw_connection()
+        target = other.engine.raw_connection()
+        try:
+            source.driver_connection.backup(target.driver_connection)
+        finally:
+            target.close()
+            source.close()
+
+    def dispose(self):
+        super().dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+file_storage = Storage(engine, SessionLocal)
+
+_empty: Optional[MemoryStorage] = None
+_empty_lock = threading.Lock()
+
+
+def memory_storage(template: Optional[MemoryStorage] = None) -> MemoryStorage:
+    """A new private database holding a copy of template, or an empty one at the latest schema version.
+
+    The empty schema is created once per process and copied from then on;
+    copying a small database takes well under a millisecond, running the DDL
+    several.
+    """
+    global _empty
+    if template is None:
+        with _empty_lock:
+            if _empty is None:
+                _empty = MemoryStorage()
+                migrations.migrate(_empty.engine)
+                atexit.register(_empty.dispose)
+        template = _empty
+    storage = MemoryStorage()
+    template.copy_to(storage)
+    return storage
@@ -0,0 +1,79 @@
+import re
+from typing import Dict, List, Optional
+from sqlalchemy import distinct, func
+from sqlalchemy.orm import Session
+import models
+
+_SEPARATORS = re.compile(r"[,.;/\n]+")
+
+
+def parse_properties(properties: Optional[str]) -> List[str]:
+    """Split a free-text properties string ("Calming, relaxing. Good for sleep") into normalized tags."""
+    tags = []
+    for part in _SEPARATORS.split(properties or ""):
+        tag = " ".join(part.split()).lower()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def sync_ingredient_tags(db: Session, ingredient: models.Ingredient):
+    """Point the ingredient's tags at its current properties text, creating missing tags."""
+    names = parse_properties(ingredient.properties)
+    existing = {tag.name: tag for tag in db.query(models.Tag).filter(models.Tag.name.in_(names))} if names else {}
+    for name in names:
+        if name not in existing:
+            existing[name] = models.Tag(name=name, user_id=ingredient.user_id)
+            db.add(existing[name])
+    ingredient.tags = [existing[name] for name in names]
+
+
+def ingredients_with_tags(db: Session, names: List[str], match_all: bool = True):
+    """Scalar subquery of ingredient ids tagged with all (or any) of the given tags."""
+    query = (
+        db.query(models.ingredient_tags.c.ingredient_id)
+        .join(models.Tag, models.Tag.id == models.ingredient_tags.c.tag_id)
+        .filter(models.Tag.name.in_(names))
+    )
+    if match_all:
+        query = query.group_by(models.ingredient_tags.c.ingredient_id).having(
+            func.count(models.ingredient_tags.c.tag_id) == len(names)
+        )
+    return query.scalar_subquery()
+
+
+def facet_counts(db: Session, column, ids_query) -> Dict[str, int]:
+    """Counts of column values among the rows whose ids ids_query selects."""
+    model = column.class_
+    return {
+        value: count
+        for value, count in db.query(column, func.count(model.id))
+        .filter(model.id.in_(ids_query), column.isnot(None))
+        .group_by(column)
+        .order_by(func.count(model.id).desc())
+        if value is not None
+    }
+
+
+def tag_counts(db: Session, ids_query) -> Dict[str, int]:
+    """Counts of each tag among the ingredients whose ids ids_query selects."""
+    return dict(
+        db.query(models.Tag.name, func.count(models.ingredient_tags.c.ingredient_id))
+        .join(models.ingredient_tags, models.ingredient_tags.c.tag_id == models.Tag.id)
+        .filter(models.ingredient_tags.c.ingredient_id.in_(ids_query))
+        .group_by(models.Tag.name)
+        .order_by(func.count(models.ingredient_tags.c.ingredient_id).desc())
+    )
+
+
+def recipe_tag_counts(db: Session, recipe_ids_query) -> Dict[str, int]:
+    """Counts of recipes, among those recipe_ids_query selects, using an ingredient with each tag."""
+    recipes = func.count(distinct(models.RecipeIngredient.recipe_id))
+    return dict(
+        db.query(models.Tag.name, recipes)
+        .join(models.ingredient_tags, models.ingredient_tags.c.tag_id == models.Tag.id)
+        .join(models.RecipeIngredient, models.RecipeIngredient.ingredient_id == models.ingredient_tags.c.ingredient_id)
+        .filter(models.RecipeIngredient.recipe_id.in_(recipe_ids_query))
+        .group_by(models.Tag.name)
+        .order_by(recipes.desc())
+    )
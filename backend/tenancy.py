@@ -0,0 +1,46 @@
+from fastapi import Depends, Header
+from sqlalchemy import event
+from sqlalchemy.orm import Session, with_loader_criteria
+from database import get_db
+import models
+
+# Tenant used when a request carries no X-User-Id header (single-shop deployments)
+DEFAULT_TENANT = "default"
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _scope_to_tenant(execute_state):
+    """Restrict every ORM SELECT/UPDATE/DELETE (including lazy loads) to the session's tenant."""
+    user_id = execute_state.session.info.get("user_id")
+    if user_id is None or execute_state.is_column_load or execute_state.is_relationship_load:
+        return
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(
+            models.TenantMixin,
+            lambda cls: cls.user_id == user_id,
+            include_aliases=True,
+        )
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_tenant(session, flush_context, instances):
+    user_id = session.info.get("user_id")
+    if user_id is None:
+        return
+    for obj in session.new:
+        if isinstance(obj, models.TenantMixin) and obj.user_id is None:
+            obj.user_id = user_id
+
+
+def get_tenant_db(x_user_id: str = Header(DEFAULT_TENANT), db: Session = Depends(get_db)):
+    """Request-scoped session bound to the caller's tenant.
+
+    X-User-Id is trusted as sent; the API does not authenticate it. It is an
+    isolation boundary only when a trusted proxy in front of the API verifies
+    the caller (e.g. their Firebase ID token) and sets the header itself,
+    replacing any value the client sent. Without such a proxy any caller can
+    read and modify any tenant's rows by changing the header.
+    """
+    db.info["user_id"] = x_user_id
+    return db
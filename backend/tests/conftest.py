@@ -0,0 +1,59 @@
+import pytest
+from fastapi.testclient import TestClient
+import main, seed_data
+from database import get_db
+from storage import memory_storage
+
+
+@pytest.fixture(scope="session")
+def template():
+    """The seed data, loaded once and copied into every test's database."""
+    storage = memory_storage()
+    seed_data.seed_database(storage)
+    yield storage
+    storage.dispose()
+
+
+@pytest.fixture(scope="session")
+def app(template):
+    storage = memory_storage(template)
+    app = main.create_app(storage)
+    yield app
+    storage.dispose()
+
+
+@pytest.fixture
+def storage(template):
+    """A private copy of the seed data for one test."""
+    storage = memory_storage(template)
+    yield storage
+    storage.dispose()
+
+
+@pytest.fixture
+def client(app, storage):
+    """A client for the shared app, serving this test's own database."""
+    previous = app.dependency_overrides[get_db]
+    app.dependency_overrides[get_db] = storage.get_db
+    try:
+        with TestClient(app) as client:
+            yield client
+    finally:
+        app.dependency_overrides[get_db] = previous
+
+
+@pytest.fixture
+def make_ingredient():
+    """Body for POST /ingredients/ with sensible defaults."""
+    def make(name, **fields):
+        data = {
+            "name": name,
+            "type": "Essential Oil",
+            "description": "",
+            "properties": "Calming",
+            "price_per_ml": 1.0,
+            "stock_amount": 100.0,
+        }
+        data.update(fields)
+        return data
+    return make
@@ -0,0 +1,120 @@
+"""Gate admission and shedding, driven on small gates."""
+import asyncio
+import pytest
+from fastapi import HTTPException
+from admission import Gate
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_queue_full_is_rejected_with_429():
+    async def scenario():
+        gate = Gate("test", capacity=1, max_queue=1, max_wait=1.0)
+        await gate.acquire(1)
+        waiter = asyncio.ensure_future(gate.acquire(1))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as rejected:
+            await gate.acquire(1)
+        gate.release(1, 0.0)
+        await waiter
+        return gate, rejected.value
+
+    gate, error = _run(scenario())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) >= 1
+    assert gate.rejected_queue_full == 1
+    assert gate.admitted == 2
+
+
+def test_wait_timeout_is_rejected_with_503():
+    async def scenario():
+        gate = Gate("test", capacity=1, max_queue=5, max_wait=0.05)
+        await gate.acquire(1)
+        with pytest.raises(HTTPException) as rejected:
+            await gate.acquire(1)
+        return gate, rejected.value
+
+    gate, error = _run(scenario())
+    assert error.status_code == 503
+    assert int(error.headers["Retry-After"]) >= 1
+    assert gate.rejected_timeout == 1
+    assert gate.metrics()["queued"] == 0
+    assert gate.in_use == 1
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        gate = Gate("test", capacity=1, max_queue=5, max_wait=1.0)
+        await gate.acquire(1)
+        waiter = asyncio.ensure_future(gate.acquire(1))
+        await asyncio.sleep(0)
+        assert gate.metrics()["queued"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return gate
+
+    gate = _run(scenario())
+    assert gate.metrics()["queued"] == 0
+    assert gate.in_use == 1
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_given_back():
+    async def scenario():
+        gate = Gate("test", capacity=1, max_queue=5, max_wait=1.0)
+        await gate.acquire(1)
+        waiter = asyncio.ensure_future(gate.acquire(1))
+        await asyncio.sleep(0)
+        # The slot is handed over, then the client goes away before the waiter resumes
+        gate.release(1, 0.0)
+        waiter.cancel()
+        try:
+            # Depending on the Python version the wait either completes or is cancelled;
+            # either way the slot must end up released exactly once
+            await waiter
+            gate.release(1, 0.0)
+        except asyncio.CancelledError:
+            pass
+        return gate
+
+    gate = _run(scenario())
+    assert gate.in_use == 0
+    assert gate.metrics()["queued"] == 0
+
+
+def test_waiters_are_woken_in_order():
+    async def scenario():
+        gate = Gate("test", capacity=4, max_queue=5, max_wait=1.0)
+        await gate.acquire(3)
+        admitted = []
+
+        async def request(name, cost):
+            await gate.acquire(cost)
+            admitted.append(name)
+
+        # The large request is first in line; the small one behind it may not overtake it
+        large = asyncio.ensure_future(request("large", 4))
+        await asyncio.sleep(0)
+        small = asyncio.ensure_future(request("small", 1))
+        await asyncio.sleep(0.01)
+        assert admitted == []
+        gate.release(3, 0.0)
+        await large
+        gate.release(4, 0.0)
+        await small
+        return admitted
+
+    assert _run(scenario()) == ["large", "small"]
+
+
+def test_full_recipe_lists_do_not_starve_other_lists(app, client, monkeypatch):
+    busy = Gate("recipe_lists", capacity=1, max_queue=0, max_wait=1.0)
+    busy.in_use = 1
+    monkeypatch.setitem(app.state.gates, "recipe_lists", busy)
+
+    rejected = client.get("/recipes/", params={"limit": 1000})
+    assert rejected.status_code == 429
+    assert "Retry-After" in rejected.headers
+    assert client.get("/ingredients/", params={"limit": 10}).status_code == 200
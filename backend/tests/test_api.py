@@ -0,0 +1,295 @@
+"""Behaviour of the main endpoints, each test on its own copy of the seed data."""
+from datetime import datetime
+import pytest
+import backup, main
+
+
+def _by_name(items):
+    return {item["name"]: item for item in items}
+
+
+def test_ingredient_crud(client, make_ingredient):
+    created = client.post("/ingredients/", json=make_ingredient("Bergamot")).json()
+    assert client.get(f"/ingredients/{created['id']}").json()["name"] == "Bergamot"
+
+    updated = client.put(f"/ingredients/{created['id']}", json=make_ingredient("Bergamot", price_per_ml=2.5))
+    assert updated.status_code == 200
+    assert updated.json()["price_per_ml"] == 2.5
+
+    assert client.delete(f"/ingredients/{created['id']}").status_code == 200
+    assert client.get(f"/ingredients/{created['id']}").status_code == 404
+
+
+def test_duplicate_name_is_a_conflict(client, make_ingredient):
+    assert client.post("/ingredients/", json=make_ingredient("Lavender Essential Oil")).status_code == 409
+
+
+def test_batch_prices_recompute_recipe_costs(client):
+    ingredients = _by_name(client.get("/ingredients/").json())
+    lavender = ingredients["Lavender Essential Oil"]
+    before = _by_name(client.get("/recipes/").json())["Relaxing Sleep Blend"]["total_cost"]
+
+    response = client.patch("/prices/batch", json={
+        "ingredients": [{"id": lavender["id"], "price_per_ml": lavender["price_per_ml"] + 1.0}],
+    })
+    assert response.status_code == 200
+    assert response.json()["ingredients_updated"] == 1
+    assert response.json()["recipes_recomputed"] >= 1
+
+    # 3 ml of lavender in the blend
+    after = _by_name(client.get("/recipes/").json())["Relaxing Sleep Blend"]["total_cost"]
+    assert abs(after - before - 3.0) < 1e-9
+
+
+def test_batch_prices_reject_unknown_ids_without_changes(client):
+    before = client.get("/ingredients/").json()
+    response = client.patch("/prices/batch", json={
+        "ingredients": [{"id": before[0]["id"], "price_per_ml": 99.0}, {"id": 999999, "price_per_ml": 1.0}],
+    })
+    assert response.status_code == 404
+    assert client.get("/ingredients/").json() == before
+
+
+def test_stock_ledger(client):
+    item = _by_name(client.get("/ingredients/").json())["Jojoba Oil"]
+    path = f"/inventory/ingredient/{item['id']}"
+    start = item["stock_amount"]
+    midpoint = datetime.utcnow().isoformat()
+
+    assert client.post("/inventory/movements", json={
+        "item_kind": "ingredient", "item_id": item["id"], "kind": "consume", "quantity": 10,
+    }).status_code == 200
+    assert client.get(f"{path}/stock").json()["stock_amount"] == start - 10
+    assert client.get(f"/ingredients/{item['id']}").json()["stock_amount"] == start - 10
+    assert client.get(f"{path}/movements").json()[0]["quantity"] == -10
+
+    assert client.post("/inventory/snapshots").status_code == 200
+    assert client.get(f"{path}/stock").json()["stock_amount"] == start - 10
+    assert client.get(f"{path}/stock", params={"at": midpoint}).json()["stock_amount"] in (None, start)
+
+
+@pytest.mark.parametrize("kind, quantity", [("consume", 1e9), ("adjust", -1e9), ("adjust", 0)])
+def test_stock_movements_that_would_break_stock_are_rejected(client, kind, quantity):
+    item = _by_name(client.get("/ingredients/").json())["Jojoba Oil"]
+    response = client.post("/inventory/movements", json={
+        "item_kind": "ingredient", "item_id": item["id"], "kind": kind, "quantity": quantity,
+    })
+    assert response.status_code == 400
+    assert client.get(f"/ingredients/{item['id']}").json()["stock_amount"] == item["stock_amount"]
+    assert client.post("/inventory/movements", json={
+        "item_kind": "ingredient", "item_id": item["id"], "kind": "consume", "quantity": item["stock_amount"],
+    }).status_code == 200
+
+def test_reports(client):
+    margins = client.get("/reports/recipe-margins").json()
+    assert len(margins) == 3
+    for row in margins:
+        assert abs(row["total_cost"] - row["ingredients_cost"] - row["packaging_cost"]) < 1e-9
+        assert abs(row["margin"] - (row["retail_price"] - row["total_cost"])) < 1e-9
+
+    shares = client.get("/reports/ingredient-cost-share").json()
+    assert abs(sum(row["share"] for row in shares) - 1.0) < 1e-9
+    usage = _by_name(client.get("/reports/ingredient-usage").json())
+    assert usage["Jojoba Oil"]["total_ml"] == 42.0
+    assert usage["Jojoba Oil"]["recipe_count"] == 2
+
+
+def test_similar_recipes(client):
+    recipes = _by_name(client.get("/recipes/").json())
+    recipe = recipes["Relaxing Sleep Blend"]
+    query = {
+        "total_volume_ml": recipe["total_volume_ml"],
+        "ingredients": [
+            {"ingredient_id": line["ingredient"]["id"], "amount_ml": line["amount_ml"]}
+            for line in recipe["recipe_ingredients"]
+        ],
+    }
+    matches = client.post("/recipes/similar", json=query).json()
+    assert matches[0]["recipe_id"] == recipe["id"]
+    assert abs(matches[0]["similarity"] - 1.0) < 1e-9
+
+    others = client.get(f"/recipes/{recipe['id']}/similar").json()
+    assert recipe["id"] not in [match["recipe_id"] for match in others]
+    assert others == sorted(others, key=lambda match: -match["similarity"])
+
+
+def test_near_duplicate_recipes_are_rejected_on_request(client):
+    recipe = _by_name(client.get("/recipes/").json())["Relaxing Sleep Blend"]
+    body = {
+        "name": "Sleep Blend Copy",
+        "description": "",
+        "total_volume_ml": recipe["total_volume_ml"],
+        "package_bundle_id": recipe["package_bundle"]["id"],
+        "ingredients": [
+            {"ingredient_id": line["ingredient"]["id"], "amount_ml": line["amount_ml"]}
+            for line in recipe["recipe_ingredients"]
+        ],
+    }
+    response = client.post("/recipes/", params={"reject_near_duplicates": True}, json=body)
+    assert response.status_code == 409
+    assert client.post("/recipes/", json=body).status_code == 200
+
+
+def test_recipe_lines_in_drops(client):
+    ingredients = _by_name(client.get("/ingredients/").json())
+    lavender = ingredients["Lavender Essential Oil"]
+    bundle = client.get("/package-bundles/").json()[0]
+    response = client.post("/recipes/", json={
+        "name": "Drops Blend",
+        "description": "",
+        "total_volume_ml": 10,
+        "package_bundle_id": bundle["id"],
+        "ingredients": [{"ingredient_id": lavender["id"], "amount": 20, "unit": "drops"}],
+    })
+    assert response.status_code == 200
+    line = response.json()["recipe_ingredients"][0]
+    drops_per_ml = lavender["drops_per_ml"] or 20.0
+    assert line["unit"] == "drops"
+    assert abs(line["amount_ml"] - 20 / drops_per_ml) < 1e-9
+    assert abs(line["cost"] - line["amount_ml"] * lavender["price_per_ml"]) < 1e-9
+
+
+def test_amount_ml_with_another_unit_is_rejected(client):
+    lavender = _by_name(client.get("/ingredients/").json())["Lavender Essential Oil"]
+    bundle = client.get("/package-bundles/").json()[0]
+    response = client.post("/recipes/", json={
+        "name": "Ambiguous Blend",
+        "description": "",
+        "total_volume_ml": 10,
+        "package_bundle_id": bundle["id"],
+        "ingredients": [{"ingredient_id": lavender["id"], "amount_ml": 20, "unit": "drops"}],
+    })
+    assert response.status_code == 422
+    assert "Ambiguous Blend" not in _by_name(client.get("/recipes/").json())
+
+def test_similar_to_stored_recipe_uses_its_ml_amounts(client):
+    lavender = _by_name(client.get("/ingredients/").json())["Lavender Essential Oil"]
+    bundle = client.get("/package-bundles/").json()[0]
+    body = {"description": "", "total_volume_ml": 10, "package_bundle_id": bundle["id"]}
+    drops = client.post("/recipes/", json=dict(
+        body, name="Drops Blend", ingredients=[{"ingredient_id": lavender["id"], "amount": 20, "unit": "drops"}]
+    )).json()
+    ml = client.post("/recipes/", json=dict(
+        body, name="Ml Blend",
+        ingredients=[{"ingredient_id": lavender["id"], "amount_ml": drops["recipe_ingredients"][0]["amount_ml"]}]
+    )).json()
+
+    matches = client.get(f"/recipes/{drops['id']}/similar").json()
+    assert matches[0]["recipe_id"] == ml["id"]
+    assert abs(matches[0]["similarity"] - 1.0) < 1e-9
+
+def test_production_sheet(client):
+    recipe = _by_name(client.get("/recipes/").json())["Relaxing Sleep Blend"]
+    response = client.post("/recipes/production-sheet", json={
+        "recipe_ids": [recipe["id"]],
+        "sizes": [{"volume_ml": recipe["total_volume_ml"], "units": 2}, {"volume_ml": 10, "units": 1}],
+    })
+    assert response.status_code == 200
+    full, small = response.json()["runs"]
+
+    # Full size: the recipe's own lines and bundle, twice
+    assert full["scale"] == 1.0
+    assert full["package_bundle_id"] == recipe["package_bundle"]["id"]
+    ingredients_cost = sum(line["cost"] for line in recipe["recipe_ingredients"])
+    assert abs(full["ingredients_cost"] - 2 * ingredients_cost) < 1e-9
+    assert abs(full["unit_cost"] - full["total_cost"] / 2) < 1e-9
+
+    # 10 ml: every line scaled down
+    scale = 10 / recipe["total_volume_ml"]
+    assert abs(small["scale"] - scale) < 1e-9
+    assert [line["amount_ml"] for line in small["lines"]] == [
+        line["amount_ml"] * scale for line in sorted(recipe["recipe_ingredients"], key=lambda l: l["ingredient"]["id"])
+    ]
+
+
+def test_recipe_update_and_delete(client, storage):
+    recipe = _by_name(client.get("/recipes/").json())["Relaxing Sleep Blend"]
+    line = recipe["recipe_ingredients"][0]
+    body = {
+        "name": recipe["name"],
+        "description": recipe["description"],
+        "total_volume_ml": recipe["total_volume_ml"],
+        "package_bundle_id": recipe["package_bundle"]["id"],
+        "ingredients": [{"ingredient_id": line["ingredient"]["id"], "amount_ml": 5.0}],
+    }
+    updated = client.put(f"/recipes/{recipe['id']}", json=body).json()
+    assert [l["amount_ml"] for l in updated["recipe_ingredients"]] == [5.0]
+
+    assert client.delete(f"/recipes/{recipe['id']}").status_code == 200
+    assert client.get(f"/recipes/{recipe['id']}").status_code == 404
+    assert recipe["id"] not in [row["recipe_id"] for row in client.get("/reports/recipe-margins").json()]
+    with storage.engine.connect() as conn:
+        lines = conn.exec_driver_sql("SELECT count(*) FROM recipe_ingredients WHERE recipe_id = ?", (recipe["id"],))
+        assert lines.scalar() == 0
+
+
+def test_ingredient_used_in_recipes_cannot_be_deleted(client):
+    lavender = _by_name(client.get("/ingredients/").json())["Lavender Essential Oil"]
+    assert client.delete(f"/ingredients/{lavender['id']}").status_code == 409
+    assert client.get(f"/ingredients/{lavender['id']}").status_code == 200
+
+
+def test_backups_disabled_without_admin_token(client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.get("/admin/backup").status_code == 404
+    assert client.post("/admin/backups", headers={"X-Admin-Token": ""}).status_code == 404
+
+
+def test_backups_require_admin_token(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(backup, "BACKUP_DIR", str(tmp_path))
+    assert client.get("/admin/backup").status_code == 403
+    assert client.post("/admin/backups", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+    response = client.get("/admin/backup", headers={"X-Admin-Token": "s3cret"})
+    assert response.status_code == 200
+    assert response.content.startswith(b"SQLite format 3")
+    assert client.post("/admin/backups", headers={"X-Admin-Token": "s3cret"}).status_code == 200
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_filters_ignore_repeated_properties(client):
+    once = client.get("/ingredients/filter", params={"properties": ["calming"]}).json()
+    assert once["total"] >= 1
+    for properties in (["calming", "Calming"], ["calming, calming"]):
+        repeated = client.get("/ingredients/filter", params={"properties": properties}).json()
+        assert repeated["total"] == once["total"]
+        assert repeated["items"] == once["items"]
+
+    recipes = client.get("/recipes/filter", params={"properties": ["calming"]}).json()
+    assert recipes["total"] >= 1
+    assert client.get("/recipes/filter", params={"properties": ["calming", "CALMING"]}).json() == recipes
+
+
+def test_recipe_filter_reports_total_and_property_facets(client):
+    everything = client.get("/recipes/filter").json()
+    assert everything["total"] == len(everything["items"]) == 3
+
+    calming = client.get("/recipes/filter", params={"properties": ["calming"], "limit": 1}).json()
+    assert len(calming["items"]) == 1
+    facets = calming["facets"]["properties"]
+    # Every matched recipe uses a calming ingredient, and no facet counts more recipes than matched
+    assert facets["calming"] == calming["total"]
+    assert max(facets.values()) == calming["total"]
+    assert all(count <= everything["facets"]["properties"][name] for name, count in facets.items())
+
+
+@pytest.mark.parametrize("path", ["/ingredients/", "/recipes/", "/ingredients/filter"])
+def test_list_limit_must_be_positive(client, path):
+    assert client.get(path, params={"limit": 0}).status_code == 422
+    assert client.get(path, params={"limit": 1}).status_code == 200
+
+
+@pytest.mark.parametrize("k", [0, -1, -3, 1001])
+def test_similar_recipes_reject_out_of_range_k(client, k):
+    recipe = _by_name(client.get("/recipes/").json())["Relaxing Sleep Blend"]
+    query = {
+        "total_volume_ml": recipe["total_volume_ml"],
+        "ingredients": [
+            {"ingredient_id": line["ingredient"]["id"], "amount_ml": line["amount_ml"]}
+            for line in recipe["recipe_ingredients"]
+        ],
+    }
+    assert client.get(f"/recipes/{recipe['id']}/similar", params={"k": k}).status_code == 422
+    assert client.post("/recipes/similar", params={"k": k}, json=query).status_code == 422
+    assert len(client.get(f"/recipes/{recipe['id']}/similar", params={"k": 1}).json()) <= 1
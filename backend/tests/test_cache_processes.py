@@ -0,0 +1,73 @@
+"""The report cache across worker processes sharing one database file."""
+import multiprocessing
+import pytest
+
+TIMEOUT = 30
+
+
+def _worker(path, conn):
+    # A separate interpreter serving the API on the same file, like a second uvicorn worker
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+    import main
+    from database import configure_engine
+    from storage import Storage
+
+    storage = Storage(configure_engine(create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})))
+    with TestClient(main.create_app(storage)) as client:
+        while True:
+            request = conn.recv()
+            if request is None:
+                break
+            method, url, body = request
+            response = client.request(method, url, json=body)
+            conn.send((response.status_code, response.json()))
+    storage.dispose()
+
+
+@pytest.fixture
+def workers(storage):
+    context = multiprocessing.get_context("spawn")
+    started = []
+    for _ in range(2):
+        parent, child = context.Pipe()
+        process = context.Process(target=_worker, args=(storage.path, child), daemon=True)
+        process.start()
+        started.append((process, parent))
+
+    def call(index, method, url, body=None):
+        process, conn = started[index]
+        conn.send((method, url, body))
+        assert conn.poll(TIMEOUT), f"worker {index} did not answer {method} {url}"
+        status, payload = conn.recv()
+        assert status == 200, payload
+        return payload
+
+    yield call
+    for process, conn in started:
+        conn.send(None)
+        process.join(TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+
+
+def _margins(call, index):
+    return {row["name"]: row for row in call(index, "GET", "/reports/recipe-margins")}
+
+
+def test_report_cached_in_one_process_recomputes_after_reprice_in_another(workers):
+    call = workers
+    before = _margins(call, 0)
+    assert _margins(call, 0) == before
+    cache = call(0, "GET", "/metrics")["cache"]
+    assert cache["hits"] >= 1
+
+    lavender = next(item for item in call(1, "GET", "/ingredients/") if item["name"] == "Lavender Essential Oil")
+    price = {"id": lavender["id"], "price_per_ml": lavender["price_per_ml"] + 1.0}
+    call(1, "PATCH", "/prices/batch", {"ingredients": [price]})
+
+    after = _margins(call, 0)
+    assert call(0, "GET", "/metrics")["cache"]["misses"] > cache["misses"]
+    # 3 ml of lavender in the blend
+    blend = "Relaxing Sleep Blend"
+    assert abs(after[blend]["ingredients_cost"] - before[blend]["ingredients_cost"] - 3.0) < 1e-9
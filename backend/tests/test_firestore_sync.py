@@ -0,0 +1,153 @@
+"""FirestoreSync against an in-memory stand-in for the Firestore client."""
+import itertools
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import update
+import models
+from firestore_sync import FirestoreSync
+
+OPERATORS = {"==": lambda a, b: a == b, ">": lambda a, b: a is not None and a > b}
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeDocument:
+    def __init__(self, docs, doc_id, writes):
+        self.id = doc_id
+        self._docs = docs
+        self._writes = writes
+
+    def set(self, data):
+        self._docs[self.id] = dict(data)
+        self._writes.append(self.id)
+
+
+class FakeQuery:
+    def __init__(self, docs, filters=()):
+        self._docs = docs
+        self._filters = filters
+
+    def where(self, field, op, value):
+        return FakeQuery(self._docs, self._filters + ((field, OPERATORS[op], value),))
+
+    def stream(self):
+        for doc_id, data in list(self._docs.items()):
+            if all(test(data.get(field), value) for field, test, value in self._filters):
+                yield FakeSnapshot(doc_id, data)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, docs, ids, writes):
+        super().__init__(docs)
+        self._ids = ids
+        self._writes = writes
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._docs, doc_id or f"doc-{next(self._ids)}", self._writes)
+
+
+class FakeFirestore:
+    """The collection/document/set/where/stream subset FirestoreSync uses."""
+
+    def __init__(self):
+        self.docs = {}
+        self.writes = []
+        self._ids = itertools.count(1)
+
+    def collection(self, name):
+        return FakeCollection(self.docs.setdefault(name, {}), self._ids, self.writes)
+
+
+@pytest.fixture
+def remote():
+    return FakeFirestore()
+
+
+@pytest.fixture
+def run_sync(storage, remote):
+    def run(method="sync"):
+        db = storage.SessionLocal()
+        try:
+            return getattr(FirestoreSync(db, remote, "default"), method)()
+        finally:
+            db.close()
+    return run
+
+
+def _doc_named(remote, collection, name):
+    return next((doc_id, data) for doc_id, data in remote.docs[collection].items() if data["name"] == name)
+
+
+def test_first_sync_pushes_everything_and_second_nothing(run_sync, remote):
+    result = run_sync()
+    assert result["pushed"]["ingredients"] == 8
+    assert len(remote.docs["recipes"]) == 3
+
+    remote.writes.clear()
+    result = run_sync()
+    assert remote.writes == []
+    assert result["pulled"] == {name: 0 for name in result["pulled"]}
+
+
+def test_pulled_rows_are_not_pushed_back(run_sync, remote, storage):
+    run_sync()
+    doc_id, data = _doc_named(remote, "ingredients", "Jojoba Oil")
+    remote.docs["ingredients"][doc_id] = dict(
+        data, description="Cold pressed", updatedAt=datetime.now(timezone.utc) + timedelta(seconds=1)
+    )
+
+    remote.writes.clear()
+    result = run_sync()
+    assert result["pulled"]["ingredients"] == 1
+    assert result["pushed"]["ingredients"] == 0
+    assert remote.writes == []
+
+    db = storage.SessionLocal()
+    try:
+        assert db.query(models.Ingredient).filter(models.Ingredient.name == "Jojoba Oil").one().description == "Cold pressed"
+    finally:
+        db.close()
+
+
+def test_push_picks_up_rows_stamped_before_the_last_push(run_sync, remote, storage):
+    run_sync()
+    db = storage.SessionLocal()
+    try:
+        pushed_at = db.query(models.SyncCheckpoint).filter(models.SyncCheckpoint.collection == "ingredients").one().pushed_at
+        # A transaction that stamped updated_at before the last push but committed after it
+        db.execute(
+            update(models.Ingredient)
+            .where(models.Ingredient.name == "Jojoba Oil")
+            .values(description="Late commit", updated_at=pushed_at - timedelta(seconds=10))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    remote.writes.clear()
+    assert run_sync("push")["ingredients"] == 1
+    assert _doc_named(remote, "ingredients", "Jojoba Oil")[1]["description"] == "Late commit"
+    assert len(remote.writes) == 1
+
+
+def test_pulled_price_recomputes_and_pushes_recipe_costs(run_sync, remote):
+    run_sync()
+    doc_id, data = _doc_named(remote, "ingredients", "Lavender Essential Oil")
+    remote.docs["ingredients"][doc_id] = dict(
+        data, costPerUnit=data["costPerUnit"] + 1.0, updatedAt=datetime.now(timezone.utc) + timedelta(seconds=1)
+    )
+    before = _doc_named(remote, "recipes", "Relaxing Sleep Blend")[1]["totalCost"]
+
+    result = run_sync()
+    assert result["pulled"]["ingredients"] == 1
+    assert result["pushed"]["ingredients"] == 0
+    assert result["pushed"]["recipes"] >= 1
+    # 3 ml of lavender in the blend
+    assert abs(_doc_named(remote, "recipes", "Relaxing Sleep Blend")[1]["totalCost"] - before - 3.0) < 1e-9
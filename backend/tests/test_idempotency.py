@@ -0,0 +1,94 @@
+"""Idempotency-Key handling, see idempotency.py."""
+import itertools
+import pytest
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+from database import get_db
+from idempotency import IdempotencyMiddleware
+
+ORIGIN = {"Origin": "http://localhost:5173"}
+
+
+def test_retry_returns_the_first_response(client, make_ingredient):
+    headers = {"Idempotency-Key": "create-bergamot"}
+    first = client.post("/ingredients/", json=make_ingredient("Bergamot"), headers=headers)
+    retry = client.post("/ingredients/", json=make_ingredient("Bergamot"), headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert [item["name"] for item in client.get("/ingredients/").json()].count("Bergamot") == 1
+
+    other = client.post("/ingredients/", json=make_ingredient("Neroli"), headers=headers)
+    assert other.status_code == 422
+
+
+@pytest.mark.parametrize("headers", [{"Idempotency-Key": ""}, {"Idempotency-Key": "k" * 300}])
+def test_rejected_keys_get_cors_headers(client, make_ingredient, headers):
+    response = client.post("/ingredients/", json=make_ingredient("Bergamot"), headers=dict(headers, **ORIGIN))
+    assert response.status_code == 400
+    assert "access-control-allow-origin" in response.headers
+
+
+def test_replays_and_mismatches_get_cors_headers(client, make_ingredient):
+    headers = dict(ORIGIN, **{"Idempotency-Key": "cors"})
+    client.post("/ingredients/", json=make_ingredient("Bergamot"), headers=headers)
+    replay = client.post("/ingredients/", json=make_ingredient("Bergamot"), headers=headers)
+    mismatch = client.post("/ingredients/", json=make_ingredient("Neroli"), headers=headers)
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert mismatch.status_code == 422
+    assert "access-control-allow-origin" in replay.headers
+    assert "access-control-allow-origin" in mismatch.headers
+
+
+@pytest.fixture
+def header_app(storage):
+    app = FastAPI()
+    app.dependency_overrides[get_db] = storage.get_db
+    app.add_middleware(IdempotencyMiddleware)
+    calls = itertools.count(1)
+
+    @app.post("/orders")
+    def create_order(response: Response):
+        response.headers["Location"] = f"/orders/{next(calls)}"
+        response.headers["Retry-After"] = "7"
+        response.set_cookie("a", "1")
+        response.set_cookie("b", "2")
+        return {"ok": True}
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_replays_return_the_stored_headers(header_app):
+    headers = {"Idempotency-Key": "order-1"}
+    first = header_app.post("/orders", headers=headers)
+    retry = header_app.post("/orders", headers=headers)
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    for name in ("Location", "Retry-After", "Content-Type"):
+        assert retry.headers[name] == first.headers[name]
+    assert retry.headers.get_list("set-cookie") == first.headers.get_list("set-cookie")
+    assert len(retry.headers.get_list("set-cookie")) == 2
+    assert retry.json() == first.json()
+
+
+@pytest.mark.parametrize("rejected", [429, 503])
+def test_rejections_are_not_stored(storage, rejected):
+    app = FastAPI()
+    app.dependency_overrides[get_db] = storage.get_db
+    app.add_middleware(IdempotencyMiddleware)
+    calls = itertools.count(1)
+
+    @app.post("/orders")
+    def create_order(response: Response):
+        if next(calls) == 1:
+            response.status_code = rejected
+            response.headers["Retry-After"] = "1"
+            return {"detail": "Busy"}
+        return {"ok": True}
+
+    with TestClient(app) as client:
+        headers = {"Idempotency-Key": "order-1"}
+        assert client.post("/orders", headers=headers).status_code == rejected
+        retry = client.post("/orders", headers=headers)
+        assert retry.status_code == 200
+        assert "Idempotent-Replayed" not in retry.headers
@@ -0,0 +1,21 @@
+import pytest
+from similarity import SimilarityIndex
+
+
+@pytest.fixture
+def index():
+    index = SimilarityIndex()
+    index.upsert(1, {1: 0.5, 2: 0.5})
+    index.upsert(2, {1: 0.9, 3: 0.1})
+    index.upsert(3, {2: 0.2, 4: 1.0})
+    return index
+
+
+def test_query_returns_best_k(index):
+    assert [recipe_id for recipe_id, _ in index.query({1: 0.5, 2: 0.5}, k=2)] == [1, 2]
+    assert [recipe_id for recipe_id, _ in index.query({1: 0.5, 2: 0.5}, k=2, exclude=1)] == [2, 3]
+
+
+@pytest.mark.parametrize("k", [0, -1, -3])
+def test_query_without_positive_k_is_empty(index, k):
+    assert index.query({1: 0.5, 2: 0.5}, k=k) == []
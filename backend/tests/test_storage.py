@@ -0,0 +1,82 @@
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+import main, migrations, models
+from storage import memory_storage
+
+
+def test_fresh_database_is_at_latest_version():
+    storage = memory_storage()
+    try:
+        migrations.check(storage.engine)
+        with storage.engine.connect() as conn:
+            assert migrations.schema_version(conn) == migrations.LATEST_VERSION
+    finally:
+        storage.dispose()
+
+
+def test_template_copies_are_independent(template):
+    first, second = memory_storage(template), memory_storage(template)
+    try:
+        db = first.SessionLocal()
+        db.query(models.Ingredient).delete()
+        db.commit()
+        db.close()
+
+        db = second.SessionLocal()
+        assert db.query(models.Ingredient).count() == 8
+        db.close()
+        db = template.SessionLocal()
+        assert db.query(models.Ingredient).count() == 8
+        db.close()
+    finally:
+        first.dispose()
+        second.dispose()
+
+
+def test_readers_do_not_see_uncommitted_writes(storage):
+    writer = storage.engine.connect()
+    transaction = writer.begin()
+    writer.execute(text("UPDATE ingredients SET price_per_ml = 1000"))
+    try:
+        with storage.engine.connect() as reader:
+            assert reader.execute(text("SELECT max(price_per_ml) FROM ingredients")).scalar() < 1000
+    finally:
+        transaction.rollback()
+        writer.close()
+
+
+def test_parallel_apps_are_isolated(template, make_ingredient):
+    errors = []
+
+    def run(i):
+        storage = memory_storage(template)
+        try:
+            with TestClient(main.create_app(storage)) as client:
+                assert client.post("/ingredients/", json=make_ingredient(f"Only in app {i}")).status_code == 200
+                names = [item["name"] for item in client.get("/ingredients/").json()]
+                assert [name for name in names if name.startswith("Only in app")] == [f"Only in app {i}"]
+        except Exception as e:
+            errors.append(e)
+        finally:
+            storage.dispose()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_app_refuses_to_start_on_unmigrated_database(tmp_path):
+    from sqlalchemy import create_engine
+    from database import configure_engine
+    from storage import Storage
+
+    storage = Storage(configure_engine(create_engine(f"sqlite:///{tmp_path / 'old.db'}")))
+    with pytest.raises(RuntimeError, match="run `python migrations.py`"):
+        with TestClient(main.create_app(storage)):
+            pass
+    storage.dispose()
@@ -0,0 +1,127 @@
+"""Tenant isolation, and a 1,000-tenant benchmark of per-tenant list queries."""
+import time
+from datetime import datetime
+import pytest
+from sqlalchemy import event, insert
+import models
+from storage import memory_storage
+
+TENANTS = 1000
+ROWS_PER_TENANT = 20
+
+
+def test_tenants_only_see_their_own_rows(client, make_ingredient):
+    shop = {"X-User-Id": "shop-a"}
+    other = {"X-User-Id": "shop-b"}
+    created = client.post("/ingredients/", json=make_ingredient("Lavender Essential Oil"), headers=shop)
+    assert created.status_code == 200  # the seeded default tenant has one too
+    assert client.post("/ingredients/", json=make_ingredient("Lavender Essential Oil"), headers=other).status_code == 200
+
+    assert [item["name"] for item in client.get("/ingredients/", headers=shop).json()] == ["Lavender Essential Oil"]
+    assert client.get(f"/ingredients/{created.json()['id']}", headers=other).status_code == 404
+    assert client.delete(f"/ingredients/{created.json()['id']}", headers=other).status_code == 404
+    assert len(client.get("/ingredients/").json()) == 8
+
+
+def _populate(storage, tenants):
+    now = datetime.utcnow()
+    rows = [
+        {
+            "user_id": f"tenant-{tenant}", "name": f"Ingredient {i}", "type": "Essential Oil", "description": "",
+            "properties": "", "price_per_ml": 1.0, "stock_amount": 10.0, "measurement_type": "ml",
+            "updated_at": now,
+        }
+        for tenant in range(tenants) for i in range(ROWS_PER_TENANT)
+    ]
+    with storage.engine.begin() as conn:
+        conn.execute(insert(models.Ingredient.__table__), rows)
+        conn.exec_driver_sql("ANALYZE")
+
+
+def _tenant_list(db):
+    return db.query(models.Ingredient).order_by(models.Ingredient.id).limit(100).all()
+
+
+def _tenant_ids(db):
+    return db.query(models.Ingredient.id).order_by(models.Ingredient.id).all()
+
+
+def _run(storage, user_id, query):
+    """Run query as user_id; returns (rows, SQL statements, SQLite VM steps)."""
+    statements = []
+    listener = lambda conn, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    event.listen(storage.engine, "before_cursor_execute", listener)
+    db = storage.SessionLocal()
+    db.info["user_id"] = user_id
+    steps = [0]
+
+    def count_step():
+        steps[0] += 1
+        return 0
+
+    try:
+        raw = db.connection().connection.driver_connection
+        raw.set_progress_handler(count_step, 1)
+        rows = query(db)
+        raw.set_progress_handler(None, 1)
+        return rows, [s for s in statements if s[0].startswith("SELECT")], steps[0]
+    finally:
+        event.remove(storage.engine, "before_cursor_execute", listener)
+        db.close()
+
+
+def _plan(storage, statement, parameters):
+    with storage.engine.connect() as conn:
+        return " / ".join(row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters))
+
+
+@pytest.fixture(scope="module")
+def crowded():
+    storage = memory_storage()
+    _populate(storage, TENANTS)
+    yield storage
+    storage.dispose()
+
+
+@pytest.fixture(scope="module")
+def alone():
+    storage = memory_storage()
+    _populate(storage, 1)
+    yield storage
+    storage.dispose()
+
+
+@pytest.mark.parametrize("query, index", [
+    (_tenant_list, "USING INDEX ix_ingredients_user_id_id"),
+    (_tenant_ids, "USING COVERING INDEX ix_ingredients_user_id_id"),
+])
+def test_tenant_queries_search_the_tenant_index(crowded, query, index):
+    rows, statements, _ = _run(crowded, "tenant-500", query)
+    assert len(rows) == ROWS_PER_TENANT
+    plan = _plan(crowded, *statements[0])
+    assert "SEARCH ingredients " + index + " (user_id=?" in plan, plan
+    assert "SCAN" not in plan and "TEMP B-TREE" not in plan, plan
+
+
+@pytest.mark.parametrize("query", [_tenant_list, _tenant_ids])
+def test_tenant_query_cost_does_not_grow_with_other_tenants(crowded, alone, query):
+    # SQLite VM steps are deterministic, unlike wall time; only the B-tree depth may add a few
+    _, _, steps_crowded = _run(crowded, "tenant-500", query)
+    _, _, steps_alone = _run(alone, "tenant-0", query)
+    assert steps_crowded <= steps_alone * 1.25, (steps_crowded, steps_alone)
+
+
+def test_tenant_list_latency(crowded, record_property):
+    timings = []
+    for tenant in range(0, TENANTS, 10):
+        started = time.perf_counter()
+        rows, _, _ = _run(crowded, f"tenant-{tenant}", _tenant_list)
+        timings.append(time.perf_counter() - started)
+        assert len(rows) == ROWS_PER_TENANT
+    timings.sort()
+    p50, p99 = timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+    # Shows up in the JUnit XML report (pytest --junitxml)
+    record_property("tenant_list_p50_ms", round(p50 * 1e3, 3))
+    record_property("tenant_list_p99_ms", round(p99 * 1e3, 3))
+    # Generous bound; a scan of all 20,000 rows per query would still pass a tight one only by luck
+    assert p50 < 0.05
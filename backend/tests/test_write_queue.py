@@ -0,0 +1,115 @@
+import threading
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+import write_queue
+
+
+@pytest.fixture
+def group_commit(monkeypatch, storage):
+    monkeypatch.setattr(write_queue, "GROUP_COMMIT", True)
+    yield
+    write_queue.stop_all(storage.engine)
+
+
+def _writes(storage):
+    writers = [writer for key, writer in write_queue._writers.items() if key is storage.engine]
+    return writers[0].metrics()["writes"] if writers else 0
+
+
+@pytest.mark.parametrize("path, name", [
+    ("/ingredients/", "Tea Tree Essential Oil"),
+    ("/packaging-items/", "Label"),
+    ("/package-bundles/", "Standard 30ml Package"),
+    ("/recipes/", "Relaxing Sleep Blend"),
+])
+def test_deletes_go_through_the_writer(client, storage, group_commit, path, name):
+    item = next(item for item in client.get(path).json() if item["name"] == name)
+    before = _writes(storage)
+    assert client.delete(f"{path}{item['id']}").status_code == 200
+    assert _writes(storage) == before + 1
+    assert client.get(f"{path}{item['id']}").status_code == 404
+    assert client.delete(f"{path}{item['id']}").status_code == 404
+
+
+def test_direct_writes_begin_immediate(client, storage):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(storage.engine, "before_cursor_execute", listener)
+    try:
+        item = client.get("/packaging-items/").json()[0]
+        statements.clear()
+        assert client.delete(f"/packaging-items/{item['id']}").status_code == 200
+    finally:
+        event.remove(storage.engine, "before_cursor_execute", listener)
+    assert statements[0] == "BEGIN IMMEDIATE"
+
+
+@pytest.mark.parametrize("grouped", [False, True])
+def test_concurrent_writers_wait_instead_of_failing(client, storage, monkeypatch, make_ingredient, grouped):
+    monkeypatch.setattr(write_queue, "GROUP_COMMIT", grouped)
+    statuses = []
+
+    def run(i):
+        for j in range(5):
+            body = make_ingredient(f"Concurrent {i}-{j}", properties="Calming, Uplifting")
+            created = client.post("/ingredients/", json=body)
+            statuses.append(created.status_code)
+            statuses.append(client.delete(f"/ingredients/{created.json()['id']}").status_code)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    write_queue.stop_all(storage.engine)
+    assert statuses == [200] * 60
+
+
+def _run_write_in_thread(storage, mutation, timeout=5.0):
+    """run_write on a fresh session; returns ("ok", result) or ("error", exception)."""
+    outcome = []
+
+    def run():
+        db = storage.SessionLocal()
+        try:
+            outcome.append(("ok", write_queue.run_write(db, mutation)))
+        except BaseException as e:
+            outcome.append(("error", e))
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "run_write never returned"
+    return outcome[0]
+
+
+def test_batch_whose_begin_fails_fails_its_requests(storage, group_commit, monkeypatch):
+    begin_write = write_queue.begin_write
+    failures = [OperationalError("BEGIN IMMEDIATE", None, Exception("database is locked"))]
+
+    def flaky_begin(db):
+        if failures:
+            raise failures.pop()
+        begin_write(db)
+
+    monkeypatch.setattr(write_queue, "begin_write", flaky_begin)
+    status, error = _run_write_in_thread(storage, lambda db: 42)
+    assert status == "error" and isinstance(error, OperationalError)
+    # The writer survives and takes the next batch
+    assert _run_write_in_thread(storage, lambda db: 43) == ("ok", 43)
+
+
+class Abort(BaseException):
+    pass
+
+
+def test_mutation_raising_base_exception_keeps_the_writer(storage, group_commit):
+    def abort(db):
+        raise Abort()
+
+    status, error = _run_write_in_thread(storage, abort)
+    assert status == "error" and isinstance(error, Abort)
+    assert _run_write_in_thread(storage, lambda db: 43) == ("ok", 43)
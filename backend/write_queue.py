@@ -0,0 +1,204 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+# Set AROMADB_GROUP_COMMIT=1 to funnel all writes through a single writer thread per database
+GROUP_COMMIT = os.environ.get("AROMADB_GROUP_COMMIT", "0") == "1"
+MAX_BATCH_SIZE = int(os.environ.get("AROMADB_GROUP_COMMIT_MAX_BATCH", "64"))
+# How long the writer waits for more work before committing a batch, in seconds
+MAX_BATCH_WAIT = float(os.environ.get("AROMADB_GROUP_COMMIT_WAIT", "0.002"))
+
+Mutation = Callable[[Session], Any]
+
+
+class WriteQueue:
+    """Single writer that coalesces many small mutations into one transaction.
+
+    Each mutation runs inside its own SAVEPOINT, so a failing request is rolled
+    back on its own while the rest of the batch still commits together.
+    """
+
+    def __init__(self, session_factory: sessionmaker, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_batch_wait: float = MAX_BATCH_WAIT):
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "writes": 0,
+            "failed_writes": 0,
+            "failed_batches": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "max_queue_depth": 0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="aromadb-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, mutation: Mutation, info: Optional[Dict[str, Any]] = None) -> Future:
+        """Queue a mutation; the future resolves with its return value once its batch commits."""
+        self.start()
+        future = Future()
+        self._queue.put((mutation, dict(info or {}), future))
+        depth = self._queue.qsize()
+        if depth > self._stats["max_queue_depth"]:
+            self._stats["max_queue_depth"] = depth
+        return future
+
+    def metrics(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_batch_size"] = stats["writes"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        while len(batch) < self.max_batch_size:
+            try:
+                entry = self._queue.get(timeout=self.max_batch_wait)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Finish the current batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._apply(batch)
+
+    def _apply(self, batch):
+        db = self.session_factory()
+        done = []
+        applied = []
+        try:
+            begin_write(db)
+            for mutation, info, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                # Swap in this request's session info (e.g. its tenant)
+                for key in applied:
+                    db.info.pop(key, None)
+                db.info.update(info)
+                applied = list(info)
+                savepoint = db.begin_nested()
+                try:
+                    result = mutation(db)
+                    db.flush()
+                    savepoint.commit()
+                except BaseException as e:
+                    # Whatever a mutation raises fails its own request, never the writer thread
+                    savepoint.rollback()
+                    self._stats["failed_writes"] += 1
+                    future.set_exception(e)
+                else:
+                    done.append((future, result))
+            db.commit()
+        except Exception as e:
+            # Fail every request still waiting, including those whose mutation never ran
+            # (e.g. BEGIN IMMEDIATE timed out on another worker's lock)
+            self._stats["failed_batches"] += 1
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            done = []
+            db.rollback()
+        finally:
+            db.close()
+
+        for future, result in done:
+            future.set_result(result)
+        self._stats["batches"] += 1
+        self._stats["writes"] += len(batch)
+        self._stats["last_batch_size"] = len(batch)
+        self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+
+
+_writers: Dict[Any, WriteQueue] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db: Session) -> WriteQueue:
+    """Return the writer for the database the given session is bound to."""
+    bind = db.get_bind()
+    with _writers_lock:
+        writer = _writers.get(bind)
+        if writer is None:
+            writer = WriteQueue(sessionmaker(autocommit=False, autoflush=False, bind=bind))
+            _writers[bind] = writer
+        return writer
+
+
+def begin_write(db: Session):
+    """Start db's next transaction as a writer (BEGIN IMMEDIATE).
+
+    Under WAL a transaction that reads before its first write fails at once
+    with "database is locked" if another writer committed in between; taking
+    the write lock up front makes it wait its turn instead. Any read
+    transaction the session already has is ended first.
+    """
+    if db.in_transaction():
+        db.commit()
+    db.connection(execution_options={"sqlite_immediate": True})
+
+
+def run_write(db: Session, mutation: Mutation) -> Any:
+    """Run a mutation and commit it, either directly on db or through the group-commit writer.
+
+    Mutations must not commit themselves and must return values that stay
+    usable after the session is closed (e.g. Pydantic schemas, not ORM rows).
+    """
+    if GROUP_COMMIT:
+        info = {key: value for key, value in db.info.items() if not key.startswith("_")}
+        return get_writer(db).submit(mutation, info).result()
+
+    try:
+        begin_write(db)
+        result = mutation(db)
+        db.commit()
+        return result
+    except Exception:
+        db.rollback()
+        raise
+
+
+def metrics() -> Dict[str, Any]:
+    return {
+        "enabled": GROUP_COMMIT,
+        "writers": [writer.metrics() for writer in _writers.values()],
+    }
+
+
+def stop_all(bind: Optional[Engine] = None):
+    """Stop the writers of every database, or only the one for bind."""
+    with _writers_lock:
+        writers = [_writers.pop(key) for key in list(_writers) if bind is None or key is bind]
+    for writer in writers:
+        writer.stop()
@@ -12,6 +12,13 @@ echo "Starting backend server..."
 cd backend
 source venv/bin/activate
 echo -en "\033]0;AromaDB Backend Server\a"
-uvicorn main:app --reload --host 0.0.0.0 --port 8000
+# Bring the schema up to date before any worker starts
+python migrations.py
+if [ -n "$WEB_CONCURRENCY" ]; then
+    # uvicorn starts $WEB_CONCURRENCY workers; no file watching
+    uvicorn main:app --host 0.0.0.0 --port 8000
+else
+    uvicorn main:app --reload --host 0.0.0.0 --port 8000
+fi
 
 echo "Backend will be available at: http://localhost:8000" 
\ No newline at end of file
@@ -13,6 +13,8 @@ echo "Starting backend server..."
 cd backend
 source venv/bin/activate
 echo -en "\033]0;AromaDB Backend Server\a"
+# Bring the schema up to date before any worker starts
+python migrations.py
 uvicorn main:app --reload --host 0.0.0.0 --port 8000 &
 
 # Wait for backend to initialize